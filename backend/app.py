@@ -3,15 +3,22 @@ FastAPI приложение для бэкенда Monopoly Telegram Bot.
 Обрабатывает API запросы от Telegram бота.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 import uvicorn
 import os
+import secrets
+import time
 
-from models import Game, Player, Property
-from game_engine import MonopolyEngine
+from models import Game, Player, PropertyOwnership
+from game_engine import GAME_NOT_FOUND, MonopolyEngine
+from sharding import ShardError, ShardedEngine
+from notifications import BotApiClient, NotificationPipeline, TELEGRAM_API_URL
+from leaderboard import LEADERBOARD_METRICS, EventJournal, LeaderboardReadModel
+from profiling import EngineProfiler
 
 app = FastAPI(title="Monopoly Telegram Bot API", version="1.0.0")
 
@@ -24,17 +31,130 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _create_engine():
+    """Движок в процессе или роутер по шардам (ENGINE_SHARDS / ENGINE_SHARD_SOCKETS)"""
+    shard_sockets = os.getenv("ENGINE_SHARD_SOCKETS")
+    if shard_sockets:
+        # Внешние шарды могут обслуживать несколько роутеров: менять топологию
+        # можно, только если этот роутер единственный (ENGINE_SINGLE_ROUTER=1)
+        return ShardedEngine(shard_sockets.split(","),
+                             owns_topology=os.getenv("ENGINE_SINGLE_ROUTER") == "1")
+    shard_count = int(os.getenv("ENGINE_SHARDS", "0"))
+    if shard_count > 0:
+        return ShardedEngine.spawn(shard_count)
+    return MonopolyEngine()
+
 # Глобальный игровой движок
-game_engine = MonopolyEngine()
+game_engine = _create_engine()
+
+# Уведомления в Telegram по логу игры (только движок в процессе: у шардов свои логи)
+notifier: Optional[NotificationPipeline] = None
+if os.getenv("BOT_TOKEN") and isinstance(game_engine, MonopolyEngine):
+    notifier = NotificationPipeline(
+        BotApiClient(os.getenv("BOT_TOKEN"), os.getenv("TELEGRAM_API_URL", TELEGRAM_API_URL))
+    )
+    game_engine.log_listeners.append(notifier.publish)
+    game_engine.event_listeners.append(notifier.handle_event)
+
+# Статистика и лидерборды по событиям движка. Шарды событий роутеру не пересылают,
+# поэтому с ShardedEngine статистика недоступна (503), а не молча пуста
+leaderboard = LeaderboardReadModel()
+stats_available = isinstance(game_engine, MonopolyEngine)
+# Журнал событий (STATS_JOURNAL_PATH): модель пересобирается из него при старте
+stats_journal: Optional[EventJournal] = None
+if stats_available:
+    leaderboard.board = game_engine.board_squares
+    if os.getenv("STATS_JOURNAL_PATH"):
+        stats_journal = EventJournal(os.getenv("STATS_JOURNAL_PATH"))
+        leaderboard.rebuild(stats_journal.events())
+        game_engine.event_listeners.append(stats_journal.append)
+    game_engine.event_listeners.append(leaderboard.apply)
+
+# Профилирование по играм (админ-API при заданном ADMIN_TOKEN, выключено по умолчанию)
+profiler = EngineProfiler(game_engine)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 class GameCreateRequest(BaseModel):
     creator_username: str
-    max_players: int = 6
+    max_players: int = Field(6, ge=2, le=6)
 
 class PlayerJoinRequest(BaseModel):
     username: str
     game_code: str
 
+class PlayerActionRequest(BaseModel):
+    player_id: str
+
+class BuyPropertyRequest(BaseModel):
+    player_id: str
+    position: int
+
+class BuildingsRequest(BaseModel):
+    player_id: str
+    levels: Dict[int, int]  # позиция -> целевой уровень: 0-4 дома, 5 — отель
+
+class BuildPlanRequest(BaseModel):
+    player_id: str
+    budget: Optional[int] = Field(None, ge=0)
+
+class ShardRequest(BaseModel):
+    address: str
+
+class NotificationSubscribeRequest(BaseModel):
+    player_id: str
+    chat_id: int
+
+async def _require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Админ-API доступно только с заданным ADMIN_TOKEN и только по нему"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def _profile_file(content: bytes, name: str, extension: str,
+                  media_type: str = "application/octet-stream") -> Response:
+    filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}"
+    return Response(content, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _require_sharded_engine() -> ShardedEngine:
+    if not isinstance(game_engine, ShardedEngine):
+        raise HTTPException(status_code=409, detail="Engine is not sharded")
+    return game_engine
+
+@app.exception_handler(ShardError)
+async def shard_error_handler(request, exc: ShardError):
+    """Сбой шарда — временная недоступность, а не 500"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+async def _require_stats() -> None:
+    if not stats_available:
+        raise HTTPException(status_code=503, detail="Statistics are not available with a sharded engine")
+
+def _game_result(result: Dict) -> Dict:
+    """Ответ движка на действие; несуществующая игра — 404 без отдельного запроса к шарду"""
+    if not result["success"] and result.get("error") == GAME_NOT_FOUND:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return result
+
+@app.on_event("startup")
+async def startup():
+    if notifier:
+        notifier.start()
+    if os.getenv("PROFILING_ENABLED") == "1":
+        profiler.enable()
+
+@app.on_event("shutdown")
+async def shutdown():
+    profiler.disable()
+    if stats_journal:
+        stats_journal.close()
+    if notifier:
+        await notifier.stop()
+        await notifier.api.close()
+    if isinstance(game_engine, ShardedEngine):
+        await game_engine.close()
+
 @app.get("/")
 async def root():
     return {"message": "Monopoly Telegram Bot API"}
@@ -42,11 +162,13 @@ async def root():
 @app.post("/api/games/create")
 async def create_game(request: GameCreateRequest):
     """Создать новую игру"""
-    game = await game_engine.create_game(
+    result = await game_engine.create_game(
         creator_username=request.creator_username,
         max_players=request.max_players
     )
-    return {"game_id": game.id, "game_code": game.code}
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return {"game_id": result["game_id"], "game_code": result["game_code"]}
 
 @app.post("/api/games/join")
 async def join_game(request: PlayerJoinRequest):
@@ -65,5 +187,141 @@ async def get_game_state(game_id: str):
         raise HTTPException(status_code=404, detail="Game not found")
     return game_state
 
+@app.post("/api/games/{game_id}/start")
+async def start_game(game_id: str):
+    """Начать игру"""
+    return _game_result(await game_engine.start_game(game_id))
+
+@app.post("/api/games/{game_id}/roll")
+async def roll_dice(game_id: str, request: PlayerActionRequest):
+    """Бросить кубики"""
+    return _game_result(await game_engine.roll_dice(game_id, request.player_id))
+
+@app.post("/api/games/{game_id}/buy")
+async def buy_property(game_id: str, request: BuyPropertyRequest):
+    """Купить недвижимость"""
+    return _game_result(await game_engine.buy_property(game_id, request.player_id, request.position))
+
+@app.post("/api/games/{game_id}/end-turn")
+async def end_turn(game_id: str, request: PlayerActionRequest):
+    """Завершить ход"""
+    return _game_result(await game_engine.end_turn(game_id, request.player_id))
+
+@app.post("/api/games/{game_id}/buildings")
+async def change_buildings(game_id: str, request: BuildingsRequest):
+    """Построить или продать дома и отели одним пакетом"""
+    return _game_result(await game_engine.change_buildings(game_id, request.player_id, request.levels))
+
+@app.post("/api/games/{game_id}/buildings/plan")
+async def plan_build(game_id: str, request: BuildPlanRequest):
+    """Лучшая застройка в пределах бюджета"""
+    return _game_result(await game_engine.plan_build(game_id, request.player_id, request.budget))
+
+@app.post("/api/games/{game_id}/notifications")
+async def subscribe_notifications(game_id: str, request: NotificationSubscribeRequest,
+                                  x_bot_token: Optional[str] = Header(None)):
+    """Подписать чат игрока на события игры (только сервис бота, по X-Bot-Token)"""
+    if not notifier:
+        return {"success": False, "error": "Уведомления отключены"}
+    if not x_bot_token or not secrets.compare_digest(x_bot_token, notifier.api.token):
+        raise HTTPException(status_code=403, detail="Invalid bot token")
+    game_state = await game_engine.get_game_state(game_id)
+    if not game_state:
+        raise HTTPException(status_code=404, detail="Game not found")
+    if not any(player["id"] == request.player_id for player in game_state["players"]):
+        raise HTTPException(status_code=403, detail="Player is not in this game")
+    notifier.subscribe(game_id, request.chat_id)
+    return {"success": True}
+
+@app.get("/api/stats/leaderboard", dependencies=[Depends(_require_stats)])
+async def get_leaderboard(metric: str = "wins", limit: int = Query(10, ge=1, le=100)):
+    """Таблица лидеров по метрике"""
+    if metric not in LEADERBOARD_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric, expected one of {LEADERBOARD_METRICS}")
+    return {"metric": metric, "leaders": leaderboard.top(metric, limit)}
+
+@app.get("/api/stats/properties", dependencies=[Depends(_require_stats)])
+async def get_property_stats(limit: int = Query(10, ge=1, le=40)):
+    """Самая доходная недвижимость"""
+    return {"properties": leaderboard.top_properties(limit)}
+
+@app.get("/api/stats/users/{username}", dependencies=[Depends(_require_stats)])
+async def get_user_stats(username: str):
+    """Статистика пользователя"""
+    stats = leaderboard.user(username)
+    if not stats:
+        raise HTTPException(status_code=404, detail="User not found")
+    return stats
+
+@app.get("/api/admin/shards", dependencies=[Depends(_require_admin)])
+async def list_shards():
+    """Шарды движка и число игр на каждом"""
+    return {"shards": await _require_sharded_engine().shard_info()}
+
+@app.post("/api/admin/shards", dependencies=[Depends(_require_admin)])
+async def add_shard(request: ShardRequest):
+    """Подключить запущенный шард (python sharding.py shard --socket ...) и перенести на него игры"""
+    try:
+        moved = await _require_sharded_engine().add_shard(request.address)
+    except ShardError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "games_moved": moved}
+
+@app.delete("/api/admin/shards", dependencies=[Depends(_require_admin)])
+async def remove_shard(address: str):
+    """Перенести игры с шарда на остальные и отключить его"""
+    try:
+        moved = await _require_sharded_engine().remove_shard(address)
+    except ShardError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "games_moved": moved}
+
+@app.get("/api/admin/profiling", dependencies=[Depends(_require_admin)])
+async def get_profiling(limit: int = Query(20, ge=1, le=200)):
+    """Самые медленные вызовы, нагрузка по играм и действиям, лаг цикла"""
+    return profiler.summary(limit)
+
+@app.post("/api/admin/profiling/enable", dependencies=[Depends(_require_admin)])
+async def enable_profiling(memory: bool = False, frames: int = Query(1, ge=1, le=64)):
+    """Включить профилирование; memory — трассировка tracemalloc"""
+    profiler.enable(memory=memory, frames=frames)
+    return {"success": True}
+
+@app.post("/api/admin/profiling/disable", dependencies=[Depends(_require_admin)])
+async def disable_profiling():
+    """Выключить профилирование и вернуть исходные методы движка"""
+    profiler.disable()
+    return {"success": True}
+
+@app.get("/api/admin/profiling/memory", dependencies=[Depends(_require_admin)])
+async def get_memory_profile(limit: int = Query(10, ge=1, le=100)):
+    """Память по играм и рост по строкам кода с момента включения"""
+    try:
+        return profiler.memory_report(limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/admin/profiling/memory/snapshot", dependencies=[Depends(_require_admin)])
+async def download_memory_snapshot():
+    """Снимок tracemalloc (tracemalloc.Snapshot.load)"""
+    try:
+        return _profile_file(profiler.memory_snapshot(), "memory", "tracemalloc")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/admin/profiling/cpu", dependencies=[Depends(_require_admin)])
+async def download_cpu_profile(seconds: float = 10.0, mode: str = "sampling",
+                               interval_ms: float = Query(5.0, ge=1.0, le=1000.0)):
+    """CPU-профиль за окно: sampling — folded-стеки, cprofile — .prof для pstats"""
+    try:
+        content = await profiler.cpu_profile(seconds, interval_ms / 1000, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if mode == "cprofile":
+        return _profile_file(content, "cpu", "prof")
+    return _profile_file(content, "cpu", "folded", "text/plain; charset=utf-8")
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
@@ -10,15 +10,39 @@
 
 import random
 import uuid
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime
 import asyncio
 import json
 
+# Цвета фишек; их число — максимальное число игроков в партии
+PLAYER_COLORS = ["🔴", "🔵", "🟢", "🟡", "🟠", "🟣"]
+
+# Ошибка действия с несуществующей игрой (API отвечает на нее 404)
+GAME_NOT_FOUND = "Игра не найдена"
+
+# Публичные асинхронные методы движка: их пересылает роутер шардов и оборачивает профилировщик
+ENGINE_METHODS = frozenset({
+    "create_game", "join_game", "start_game", "roll_dice", "buy_property",
+    "mortgage_property", "unmortgage_property", "end_turn", "get_game_state", "has_game",
+    "change_buildings", "plan_build",
+})
+
 class MonopolyEngine:
-    def __init__(self):
+    def __init__(self, code_generator: Optional[Callable[[str], str]] = None):
         self.games: Dict[str, Dict] = {}
+        # Генератор кода приглашения по game_id (в шардированном режиме код кодирует слот шарда)
+        self.code_generator = code_generator or (lambda game_id: str(random.randint(100000, 999999)))
+        # Подписчики на записи лога: callback(game_id, log_entry)
+        self.log_listeners: List[Callable[[str, Dict], None]] = []
+        # Подписчики на структурированные события: callback(game_id, event)
+        self.event_listeners: List[Callable[[str, Dict], None]] = []
         self.board_squares = self._initialize_board()
+        # Цветовые группы: group -> позиции улиц (для монополий и застройки)
+        self.color_groups: Dict[str, List[int]] = {}
+        for square in self.board_squares:
+            if square["type"] == "property":
+                self.color_groups.setdefault(square["group"], []).append(square["id"])
         self.chance_cards = self._initialize_chance_cards()
         self.community_chest_cards = self._initialize_community_cards()
         
@@ -88,10 +112,13 @@ class MonopolyEngine:
             {"text": "Освобождение из тюрьмы", "action": "get_out_of_jail_card"}
         ]
 
-    async def create_game(self, creator_username: str, max_players: int = 6) -> Dict:
+    async def create_game(self, creator_username: str, max_players: int = 6,
+                          game_id: Optional[str] = None) -> Dict:
         """Создать новую игру"""
-        game_id = str(uuid.uuid4())
-        game_code = str(random.randint(100000, 999999))
+        if not 2 <= max_players <= len(PLAYER_COLORS):
+            return {"success": False, "error": f"Игроков может быть от 2 до {len(PLAYER_COLORS)}"}
+        game_id = game_id or str(uuid.uuid4())
+        game_code = self.code_generator(game_id)
         
         game_state = {
             "id": game_id,
@@ -106,7 +133,8 @@ class MonopolyEngine:
             "houses_remaining": 32,
             "hotels_remaining": 12,
             "turn_order": [],
-            "game_log": []
+            "game_log": [],
+            "version": 0  # Растет на единицу с каждым изменяющим действием
         }
         
         self.games[game_id] = game_state
@@ -124,7 +152,7 @@ class MonopolyEngine:
         game = self._find_game_by_code(game_code)
         
         if not game:
-            return {"success": False, "error": "Игра не найдена"}
+            return {"success": False, "error": GAME_NOT_FOUND}
             
         if game["status"] != "waiting":
             return {"success": False, "error": "Игра уже началась"}
@@ -138,7 +166,6 @@ class MonopolyEngine:
                 return {"success": False, "error": "Вы уже в этой игре"}
         
         # Создание нового игрока
-        player_colors = ["🔴", "🔵", "🟢", "🟡", "🟠", "🟣"]
         player_id = str(uuid.uuid4())
         
         player = {
@@ -146,7 +173,7 @@ class MonopolyEngine:
             "username": username,
             "position": 0,
             "money": 1500,
-            "color": player_colors[len(game["players"])],
+            "color": PLAYER_COLORS[len(game["players"])],
             "is_in_jail": False,
             "jail_turns": 0,
             "consecutive_doubles": 0,
@@ -157,6 +184,7 @@ class MonopolyEngine:
         
         game["players"].append(player)
         game["turn_order"].append(player_id)
+        game["version"] += 1
         
         self._add_game_log(game["id"], f"👤 {username} присоединился к игре")
         
@@ -169,7 +197,7 @@ class MonopolyEngine:
     async def start_game(self, game_id: str) -> Dict:
         """Начать игру"""
         if game_id not in self.games:
-            return {"success": False, "error": "Игра не найдена"}
+            return {"success": False, "error": GAME_NOT_FOUND}
             
         game = self.games[game_id]
         
@@ -183,28 +211,26 @@ class MonopolyEngine:
         random.shuffle(game["turn_order"])
         game["status"] = "active"
         game["current_player_index"] = 0
+        game["version"] += 1
         
         self._add_game_log(game_id, "🚀 Игра началась!")
+        self._emit_event(game_id, "game_started", players=[p["username"] for p in game["players"]])
         
         return {"success": True, "current_player": game["turn_order"][0]}
 
     async def roll_dice(self, game_id: str, player_id: str) -> Dict:
         """Бросить кубики"""
         game = self.games.get(game_id)
-        if not game:
-            return {"success": False, "error": "Игра не найдена"}
-            
+        error = self._turn_error(game, player_id)
+        if error:
+            return error
         player = self._get_player(game, player_id)
-        if not player:
-            return {"success": False, "error": "Игрок не найден"}
-            
-        if not self._is_player_turn(game, player_id):
-            return {"success": False, "error": "Не ваш ход"}
         
         dice1 = random.randint(1, 6)
         dice2 = random.randint(1, 6)
         total = dice1 + dice2
         is_double = dice1 == dice2
+        game["version"] += 1
         
         self._add_game_log(game_id, f"🎲 {player['username']} бросил кубики: {dice1} + {dice2} = {total}" + 
                           (" (Дубль!)" if is_double else ""))
@@ -395,6 +421,8 @@ class MonopolyEngine:
             owner["money"] += rent
             
             self._add_game_log(game_id, f"💰 {player['username']} заплатил {rent}₽ аренды игроку {owner['username']} за {square['name']}")
+            self._emit_event(game_id, "rent_paid", payer=player["username"], owner=owner["username"],
+                             position=position, amount=rent)
             
             return {
                 "action": "paid_rent",
@@ -424,21 +452,27 @@ class MonopolyEngine:
 
     def _has_monopoly(self, game: Dict, player_id: str, color_group: str) -> bool:
         """Проверка монополии игрока в цветовой группе"""
-        group_properties = [sq for sq in self.board_squares if sq.get("group") == color_group and sq["type"] == "property"]
-        owned_count = 0
-        
-        for prop in group_properties:
-            prop_info = game["properties"].get(str(prop["id"]))
-            if prop_info and prop_info["owner_id"] == player_id:
-                owned_count += 1
-        
-        return owned_count == len(group_properties)
+        for position in self.color_groups.get(color_group, []):
+            prop_info = game["properties"].get(str(position))
+            if not prop_info or prop_info["owner_id"] != player_id:
+                return False
+        return True
 
     async def buy_property(self, game_id: str, player_id: str, position: int) -> Dict:
         """Купить недвижимость"""
-        game = self.games[game_id]
+        game = self.games.get(game_id)
+        error = self._turn_error(game, player_id)
+        if error:
+            return error
         player = self._get_player(game, player_id)
+        
+        if not 0 <= position < len(self.board_squares):
+            return {"success": False, "error": "Нет такой клетки"}
         square = self.board_squares[position]
+        if square["type"] not in ("property", "railroad", "utility"):
+            return {"success": False, "error": "Эту клетку нельзя купить"}
+        if player["position"] != position:
+            return {"success": False, "error": "Можно купить только клетку, на которой вы стоите"}
         
         if str(position) in game["properties"]:
             return {"success": False, "error": "Недвижимость уже куплена"}
@@ -456,15 +490,26 @@ class MonopolyEngine:
             "hotels": 0,
             "mortgaged": False
         }
+        game["version"] += 1
         
         self._add_game_log(game_id, f"🏠 {player['username']} купил {square['name']} за {square['price']}₽")
+        self._emit_event(game_id, "property_bought", username=player["username"], position=position,
+                         price=square["price"])
         
         return {"success": True, "amount_paid": square["price"]}
 
     async def mortgage_property(self, game_id: str, player_id: str, position: int) -> Dict:
         """Заложить недвижимость"""
-        game = self.games[game_id]
+        game = self.games.get(game_id)
+        if not game:
+            return {"success": False, "error": GAME_NOT_FOUND}
         player = self._get_player(game, player_id)
+        if not player:
+            return {"success": False, "error": "Игрок не найден"}
+        if game["status"] != "active":
+            return {"success": False, "error": "Игра не идет"}
+        if not 0 <= position < len(self.board_squares):
+            return {"success": False, "error": "Нет такой клетки"}
         square = self.board_squares[position]
         
         property_info = game["properties"].get(str(position))
@@ -474,13 +519,18 @@ class MonopolyEngine:
         if property_info["mortgaged"]:
             return {"success": False, "error": "Недвижимость уже заложена"}
         
-        if property_info["houses"] > 0 or property_info["hotels"] > 0:
-            return {"success": False, "error": "Сначала продайте все постройки"}
+        # Как в классических правилах: в застроенной группе ничего не закладывается,
+        # иначе change_buildings не дал бы продать дома на соседних клетках
+        group = self.color_groups.get(square["group"], [position])
+        if any(self._building_level(game["properties"][str(p)])
+               for p in group if str(p) in game["properties"]):
+            return {"success": False, "error": "Сначала продайте все постройки в цветовой группе"}
         
         # Залог
         mortgage_value = square["mortgage"]
         player["money"] += mortgage_value
         property_info["mortgaged"] = True
+        game["version"] += 1
         
         self._add_game_log(game_id, f"🏦 {player['username']} заложил {square['name']} за {mortgage_value}₽")
         
@@ -488,8 +538,16 @@ class MonopolyEngine:
 
     async def unmortgage_property(self, game_id: str, player_id: str, position: int) -> Dict:
         """Выкупить недвижимость из залога"""
-        game = self.games[game_id]
+        game = self.games.get(game_id)
+        if not game:
+            return {"success": False, "error": GAME_NOT_FOUND}
         player = self._get_player(game, player_id)
+        if not player:
+            return {"success": False, "error": "Игрок не найден"}
+        if game["status"] != "active":
+            return {"success": False, "error": "Игра не идет"}
+        if not 0 <= position < len(self.board_squares):
+            return {"success": False, "error": "Нет такой клетки"}
         square = self.board_squares[position]
         
         property_info = game["properties"].get(str(position))
@@ -508,20 +566,217 @@ class MonopolyEngine:
         # Выкуп
         player["money"] -= unmortgage_cost
         property_info["mortgaged"] = False
+        game["version"] += 1
         
         self._add_game_log(game_id, f"🏦 {player['username']} выкупил {square['name']} за {unmortgage_cost}₽")
         
         return {"success": True, "amount_paid": unmortgage_cost}
 
+    @staticmethod
+    def _building_level(property_info: Dict) -> int:
+        """Уровень застройки: 0-4 дома, 5 — отель"""
+        return 5 if property_info["hotels"] else property_info["houses"]
+
+    def _level_rent(self, position: int, level: int) -> int:
+        """Аренда застроенной монополии на заданном уровне"""
+        rent = self.board_squares[position]["rent"]
+        return rent[level] if level else rent[0] * 2
+
+    async def change_buildings(self, game_id: str, player_id: str, levels: Dict[int, int]) -> Dict:
+        """Построить и продать дома/отели пакетом: levels — целевой уровень (0-5) по позициям.
+
+        Проверки за один проход по затронутым группам: монополия, отсутствие залога,
+        равномерная застройка в итоговом состоянии, запас домов и отелей в банке, деньги.
+        Пакет применяется целиком или не применяется вовсе.
+        """
+        game = self.games.get(game_id)
+        if not game:
+            return {"success": False, "error": GAME_NOT_FOUND}
+        player = self._get_player(game, player_id)
+        if not player:
+            return {"success": False, "error": "Игрок не найден"}
+        if game["status"] != "active":
+            return {"success": False, "error": "Игра не идет"}
+
+        targets: Dict[int, int] = {}
+        for position, level in levels.items():
+            position = int(position)
+            if not 0 <= position < len(self.board_squares) or self.board_squares[position]["type"] != "property":
+                return {"success": False, "error": f"На клетке {position} нельзя строить"}
+            if not 0 <= level <= 5:
+                return {"success": False, "error": "Уровень застройки должен быть от 0 до 5"}
+            targets[position] = level
+
+        houses_delta = hotels_delta = cost = refund = 0
+        for group in sorted({self.board_squares[position]["group"] for position in targets}):
+            positions = self.color_groups[group]
+            if not self._has_monopoly(game, player_id, group):
+                return {"success": False, "error": "Для строительства нужна вся цветовая группа"}
+            group_mortgaged = any(game["properties"][str(p)]["mortgaged"] for p in positions)
+            group_levels = []
+            for position in positions:
+                current = self._building_level(game["properties"][str(position)])
+                target = targets.get(position, current)
+                if target != current and group_mortgaged:
+                    return {"success": False, "error": "В группе есть заложенная недвижимость"}
+                group_levels.append(target)
+
+                house_price = self.board_squares[position]["house_price"]
+                if target > current:
+                    cost += (target - current) * house_price
+                else:
+                    refund += (current - target) * house_price // 2
+                houses_delta += (target if target < 5 else 0) - (current if current < 5 else 0)
+                hotels_delta += (target == 5) - (current == 5)
+            if max(group_levels) - min(group_levels) > 1:
+                return {"success": False, "error": "Нарушено правило равномерной застройки"}
+
+        if houses_delta > game["houses_remaining"]:
+            return {"success": False, "error": "В банке не хватает домов"}
+        if hotels_delta > game["hotels_remaining"]:
+            return {"success": False, "error": "В банке не хватает отелей"}
+        if cost - refund > player["money"]:
+            return {"success": False, "error": "Недостаточно денег"}
+
+        targets = {position: level for position, level in targets.items()
+                   if level != self._building_level(game["properties"][str(position)])}
+        if not targets:
+            return {"success": False, "error": "Застройка не меняется"}
+
+        for position, level in targets.items():
+            property_info = game["properties"][str(position)]
+            property_info["houses"] = level if level < 5 else 0
+            property_info["hotels"] = 1 if level == 5 else 0
+        game["houses_remaining"] -= houses_delta
+        game["hotels_remaining"] -= hotels_delta
+        player["money"] += refund - cost
+        game["version"] += 1
+
+        changes = ", ".join(f"{self.board_squares[p]['name']}: {'отель' if l == 5 else f'{l} д.'}"
+                            for p, l in sorted(targets.items()))
+        self._add_game_log(game_id, f"🏗️ {player['username']} изменил застройку ({changes}), "
+                                    f"потратил {cost}₽, выручил {refund}₽")
+
+        return {
+            "success": True,
+            "cost": cost,
+            "refund": refund,
+            "houses_remaining": game["houses_remaining"],
+            "hotels_remaining": game["hotels_remaining"],
+            "version": game["version"]
+        }
+
+    def _group_build_options(self, game: Dict, player_id: str, group: str) -> List[Tuple]:
+        """Варианты достройки группы: (стоимость, дома, отели, прирост аренды, уровни).
+
+        Для каждой суммы уровней T равномерная застройка задает base = T // k на всех
+        клетках и +1 на T % k из них; лишний уровень получают клетки, уже стоящие выше,
+        затем самые доходные.
+        """
+        positions = self.color_groups[group]
+        current = {p: self._building_level(game["properties"][str(p)]) for p in positions}
+        current_rent = sum(self._level_rent(p, level) for p, level in current.items())
+        house_price = self.board_squares[positions[0]]["house_price"]
+        ranked = sorted(positions, key=lambda p: (-current[p], -self.board_squares[p]["rent"][-1]))
+        options = []
+        for total in range(sum(current.values()), 5 * len(positions) + 1):
+            base, extra = divmod(total, len(positions))
+            levels = {p: base + (1 if i < extra else 0) for i, p in enumerate(ranked)}
+            if any(levels[p] < current[p] for p in positions):
+                continue
+            houses = sum((levels[p] if levels[p] < 5 else 0) - (current[p] if current[p] < 5 else 0)
+                         for p in positions)
+            hotels = sum((levels[p] == 5) - (current[p] == 5) for p in positions)
+            gain = sum(self._level_rent(p, level) for p, level in levels.items()) - current_rent
+            options.append(((total - sum(current.values())) * house_price, houses, hotels, gain, levels))
+        return options
+
+    async def plan_build(self, game_id: str, player_id: str, budget: Optional[int] = None) -> Dict:
+        """Лучшая доступная застройка в пределах бюджета (максимум прироста аренды).
+
+        Рюкзак с выбором одного варианта на группу; ограничения — бюджет и запас
+        домов/отелей в банке (как в change_buildings, на весь пакет). Для каждого
+        расхода домов и отелей хранится только граница Парето «стоимость — прирост».
+        Расход ниже порога, после которого банк уже не может кончиться, не
+        различается, так что к последней группе остается одна граница.
+        Результат можно сразу передать в change_buildings.
+        """
+        game = self.games.get(game_id)
+        if not game:
+            return {"success": False, "error": GAME_NOT_FOUND}
+        player = self._get_player(game, player_id)
+        if not player:
+            return {"success": False, "error": "Игрок не найден"}
+        if game["status"] != "active":
+            return {"success": False, "error": "Игра не идет"}
+        budget = player["money"] if budget is None else max(0, min(budget, player["money"]))
+        houses_limit, hotels_limit = game["houses_remaining"], game["hotels_remaining"]
+
+        options = [self._group_build_options(game, player_id, group)
+                   for group, positions in self.color_groups.items()
+                   if self._has_monopoly(game, player_id, group)
+                   and not any(game["properties"][str(p)]["mortgaged"] for p in positions)]
+        # Сколько домов и отелей еще могут взять (max) или вернуть (min) оставшиеся группы
+        future = [(0, 0, 0)]
+        for group in reversed(options):
+            max_houses, min_houses, max_hotels = future[-1]
+            future.append((max_houses + max(option[1] for option in group),
+                           min_houses + min(option[1] for option in group),
+                           max_hotels + max(option[2] for option in group)))
+        future.reverse()
+
+        # (дома, отели) -> граница [(стоимость, прирост, цепочка уровней)] по возрастанию
+        # стоимости и прироста; цепочка — (уровни группы, предыдущая цепочка)
+        frontiers: Dict[Tuple[int, int], List[Tuple]] = {(0, 0): [(0, 0, None)]}
+        for index, group in enumerate(options):
+            max_houses, min_houses, max_hotels = future[index + 1]
+            candidates: Dict[Tuple[int, int], List[Tuple]] = {}
+            for (houses, hotels), frontier in frontiers.items():
+                for option_cost, option_houses, option_hotels, option_gain, option_levels in group:
+                    total_houses, total_hotels = houses + option_houses, hotels + option_hotels
+                    if total_houses + min_houses > houses_limit or total_hotels > hotels_limit:
+                        continue
+                    key = (max(total_houses, houses_limit - max_houses), max(total_hotels, hotels_limit - max_hotels))
+                    states = candidates.setdefault(key, [])
+                    for cost, gain, chain in frontier:
+                        if cost + option_cost > budget:
+                            break
+                        states.append((cost + option_cost, gain + option_gain, (option_levels, chain)))
+            frontiers = {}
+            for key, states in candidates.items():
+                states.sort(key=lambda state: (state[0], -state[1]))
+                frontier = []
+                for state in states:
+                    if not frontier or state[1] > frontier[-1][1]:
+                        frontier.append(state)
+                if frontier:
+                    frontiers[key] = frontier
+
+        cost, gain, chain = max((frontier[-1] for frontier in frontiers.values()),
+                                key=lambda state: (state[1], -state[0]))
+        levels: Dict[int, int] = {}
+        while chain is not None:
+            group_levels, chain = chain
+            levels.update(group_levels)
+        current = {p: self._building_level(game["properties"][str(p)]) for p in levels}
+        return {
+            "success": True,
+            "levels": {p: level for p, level in levels.items() if level != current[p]},
+            "cost": cost,
+            "rent_gain": gain,
+            "budget": budget
+        }
+
     async def end_turn(self, game_id: str, player_id: str) -> Dict:
         """Завершить ход"""
-        game = self.games[game_id]
-        
-        if not self._is_player_turn(game, player_id):
-            return {"success": False, "error": "Не ваш ход"}
+        game = self.games.get(game_id)
+        error = self._turn_error(game, player_id)
+        if error:
+            return error
         
         # Переход к следующему игроку
         game["current_player_index"] = (game["current_player_index"] + 1) % len(game["turn_order"])
+        game["version"] += 1
         next_player_id = game["turn_order"][game["current_player_index"]]
         next_player = self._get_player(game, next_player_id)
         
@@ -545,6 +800,18 @@ class MonopolyEngine:
         current_player_id = game["turn_order"][game["current_player_index"]]
         return current_player_id == player_id
 
+    def _turn_error(self, game: Optional[Dict], player_id: str) -> Optional[Dict]:
+        """Ошибка, если игрок сейчас не может ходить в этой игре"""
+        if not game:
+            return {"success": False, "error": GAME_NOT_FOUND}
+        if game["status"] != "active":
+            return {"success": False, "error": "Игра не идет"}
+        if not self._get_player(game, player_id):
+            return {"success": False, "error": "Игрок не найден"}
+        if not self._is_player_turn(game, player_id):
+            return {"success": False, "error": "Не ваш ход"}
+        return None
+
     def _find_game_by_code(self, game_code: str) -> Optional[Dict]:
         """Найти игру по коду"""
         for game in self.games.values():
@@ -561,11 +828,25 @@ class MonopolyEngine:
                 "message": message
             }
             game["game_log"].append(log_entry)
+            for listener in self.log_listeners:
+                listener(game_id, log_entry)
             
             # Ограничиваем лог до 100 последних записей
             if len(game["game_log"]) > 100:
                 game["game_log"] = game["game_log"][-100:]
 
+    def _emit_event(self, game_id: str, event_type: str, **data) -> None:
+        """Отправить структурированное событие подписчикам"""
+        if not self.event_listeners:
+            return
+        event = {"type": event_type, "timestamp": datetime.utcnow().isoformat(), **data}
+        for listener in self.event_listeners:
+            listener(game_id, event)
+
+    async def has_game(self, game_id: str) -> bool:
+        """Проверить, существует ли игра"""
+        return game_id in self.games
+
     async def get_game_state(self, game_id: str) -> Optional[Dict]:
         """Получить полное состояние игры"""
         game = self.games.get(game_id)
@@ -577,11 +858,13 @@ class MonopolyEngine:
             "code": game["code"],
             "status": game["status"],
             "current_player_index": game["current_player_index"],
+            "turn_order": game["turn_order"],
             "players": game["players"],
             "properties": game["properties"],
             "board": self.board_squares,
             "houses_remaining": game["houses_remaining"],
             "hotels_remaining": game["hotels_remaining"],
+            "version": game["version"],
             "game_log": game["game_log"][-20:]  # Последние 20 записей
         }
 
@@ -599,16 +882,22 @@ class MonopolyEngine:
                 properties_to_free.append(pos_str)
         
         for pos_str in properties_to_free:
-            del game["properties"][pos_str]
+            # Постройки возвращаются в банк вместе с недвижимостью
+            prop_info = game["properties"].pop(pos_str)
+            game["houses_remaining"] += prop_info["houses"]
+            game["hotels_remaining"] += prop_info["hotels"]
         
         self._add_game_log(game_id, f"💸 {player['username']} обанкротился!")
+        self._emit_event(game_id, "bankruptcy", username=player["username"])
         
         # Проверяем окончание игры
         active_players = [p for p in game["players"] if not p["is_bankrupt"]]
-        if len(active_players) <= 1:
+        if len(active_players) <= 1 and game["status"] != "finished":
             game["status"] = "finished"
             if active_players:
                 self._add_game_log(game_id, f"🏆 {active_players[0]['username']} победил!")
+            self._emit_event(game_id, "game_finished",
+                             winner=active_players[0]["username"] if active_players else None)
         
         return {"bankruptcy": True}
 
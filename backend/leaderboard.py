@@ -0,0 +1,227 @@
+"""
+Статистика игроков и таблицы лидеров.
+
+Read-модель обновляется инкрементально по событиям движка
+(MonopolyEngine.event_listeners): game_started, property_bought, rent_paid,
+bankruptcy, game_finished. Каждое событие — O(1) обновление счетчиков
+плюс O(log K) правка топа, поэтому лидерборды отдаются сразу, без
+сканирования GameAction.
+
+События пишутся в журнал (EventJournal — append-only JSONL), и при старте
+модель пересобирается из него (rebuild), так что статистика переживает
+перезапуск. rebuild принимает и строки GameAction
+(game_action_from_event / events_from_game_actions).
+"""
+
+import bisect
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models import GameAction
+
+logger = logging.getLogger(__name__)
+
+# Метрики лидербордов: все счетчики только растут
+LEADERBOARD_METRICS = ("wins", "games_played", "rent_collected")
+EVENT_TYPES = frozenset({"game_started", "property_bought", "rent_paid", "bankruptcy", "game_finished"})
+
+
+class TopK:
+    """Топ-K ключей по неубывающему значению в отсортированном списке"""
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._entries: List[Tuple[int, str]] = []  # (-значение, ключ) по возрастанию
+        self._values: Dict[str, int] = {}
+
+    def update(self, key: str, value: int) -> None:
+        old = self._values.get(key)
+        if old is not None:
+            del self._entries[bisect.bisect_left(self._entries, (-old, key))]
+        elif len(self._entries) >= self.capacity and (-value, key) >= self._entries[-1]:
+            # Значения только растут: вытесненный ключ не может оказаться выше минимума топа
+            return
+        bisect.insort(self._entries, (-value, key))
+        self._values[key] = value
+        if len(self._entries) > self.capacity:
+            _, evicted = self._entries.pop()
+            del self._values[evicted]
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        return [(key, -value) for value, key in self._entries[:limit]]
+
+
+class UserStats:
+    """Счетчики одного пользователя"""
+
+    __slots__ = ("username", "games_played", "wins", "bankruptcies", "properties_bought",
+                 "money_spent_on_properties", "rent_collected", "rent_paid", "rent_by_property")
+
+    def __init__(self, username: str):
+        self.username = username
+        self.games_played = 0
+        self.wins = 0
+        self.bankruptcies = 0
+        self.properties_bought = 0
+        self.money_spent_on_properties = 0
+        self.rent_collected = 0
+        self.rent_paid = 0
+        self.rent_by_property: Dict[int, int] = {}
+
+    def to_dict(self, board: Optional[List[Dict]] = None, top_properties: int = 3) -> Dict:
+        best = sorted(self.rent_by_property.items(), key=lambda item: (-item[1], item[0]))[:top_properties]
+        return {
+            "username": self.username,
+            "games_played": self.games_played,
+            "wins": self.wins,
+            "bankruptcies": self.bankruptcies,
+            "properties_bought": self.properties_bought,
+            "money_spent_on_properties": self.money_spent_on_properties,
+            "rent_collected": self.rent_collected,
+            "rent_paid": self.rent_paid,
+            "most_profitable_properties": [_property_entry(position, rent, board) for position, rent in best],
+        }
+
+
+def _property_entry(position: int, rent: int, board: Optional[List[Dict]]) -> Dict:
+    entry = {"position": position, "rent_collected": rent}
+    if board:
+        entry["name"] = board[position]["name"]
+    return entry
+
+
+class LeaderboardReadModel:
+    """Инкрементальная статистика по событиям движка"""
+
+    def __init__(self, board: Optional[List[Dict]] = None, capacity: int = 100):
+        self.board = board
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self) -> None:
+        self.users: Dict[str, UserStats] = {}
+        self.leaderboards = {metric: TopK(self.capacity) for metric in LEADERBOARD_METRICS}
+        self.rent_by_property: Dict[int, int] = {}
+        self.events_applied = 0
+
+    def _user(self, username: str) -> UserStats:
+        stats = self.users.get(username)
+        if stats is None:
+            stats = self.users[username] = UserStats(username)
+        return stats
+
+    def apply(self, game_id: str, event: Dict) -> None:
+        """Слушатель событий движка (MonopolyEngine.event_listeners)"""
+        event_type = event["type"]
+        if event_type == "game_started":
+            for username in event["players"]:
+                stats = self._user(username)
+                stats.games_played += 1
+                self.leaderboards["games_played"].update(username, stats.games_played)
+        elif event_type == "property_bought":
+            stats = self._user(event["username"])
+            stats.properties_bought += 1
+            stats.money_spent_on_properties += event["price"]
+        elif event_type == "rent_paid":
+            position, amount = event["position"], event["amount"]
+            owner = self._user(event["owner"])
+            owner.rent_collected += amount
+            owner.rent_by_property[position] = owner.rent_by_property.get(position, 0) + amount
+            self._user(event["payer"]).rent_paid += amount
+            self.rent_by_property[position] = self.rent_by_property.get(position, 0) + amount
+            self.leaderboards["rent_collected"].update(owner.username, owner.rent_collected)
+        elif event_type == "bankruptcy":
+            self._user(event["username"]).bankruptcies += 1
+        elif event_type == "game_finished":
+            if event.get("winner"):
+                stats = self._user(event["winner"])
+                stats.wins += 1
+                self.leaderboards["wins"].update(stats.username, stats.wins)
+        else:
+            return
+        self.events_applied += 1
+
+    def rebuild(self, events: Iterable[Tuple[str, Dict]]) -> int:
+        """Пересобрать модель с нуля из журнала (game_id, event) в исходном порядке"""
+        self.reset()
+        for game_id, event in events:
+            self.apply(game_id, event)
+        return self.events_applied
+
+    def top(self, metric: str, limit: int = 10) -> List[Dict]:
+        if metric not in self.leaderboards:
+            raise ValueError(f"Неизвестная метрика: {metric}")
+        return [{"username": username, metric: value}
+                for username, value in self.leaderboards[metric].top(min(limit, self.capacity))]
+
+    def top_properties(self, limit: int = 10) -> List[Dict]:
+        # Клеток с арендой не больше 28 — сортировка дешевле поддержки отдельной структуры
+        best = sorted(self.rent_by_property.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [_property_entry(position, rent, self.board) for position, rent in best]
+
+    def user(self, username: str) -> Optional[Dict]:
+        stats = self.users.get(username)
+        return stats.to_dict(self.board) if stats else None
+
+
+class EventJournal:
+    """Журнал событий статистики: JSON-строка {"game_id", "event"} на событие"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def append(self, game_id: str, event: Dict) -> None:
+        """Слушатель событий движка (MonopolyEngine.event_listeners)"""
+        if event["type"] not in EVENT_TYPES:
+            return
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Построчная буферизация: каждое событие уходит в файл одной записью
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            if self._file.tell() and not self._ends_with_newline():
+                # Оборванную при сбое строку закрываем, чтобы не испортить следующую
+                self._file.write("\n")
+        self._file.write(json.dumps({"game_id": game_id, "event": event}, ensure_ascii=False) + "\n")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b"\n"
+
+    def events(self) -> Iterator[Tuple[str, Dict]]:
+        """События журнала в порядке записи; оборванная при сбое строка пропускается"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as journal:
+            for number, line in enumerate(journal, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Пропущена поврежденная строка %d журнала %s", number, self.path)
+                    continue
+                yield record["game_id"], record["event"]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def game_action_from_event(game_id: str, event: Dict) -> GameAction:
+    """Строка журнала для сохранения события"""
+    return GameAction(game_id=game_id, action_type=event["type"],
+                      data=json.dumps(event, ensure_ascii=False))
+
+
+def events_from_game_actions(actions: Iterable) -> Iterable[Tuple[str, Dict]]:
+    """События из строк GameAction (action_type — тип события, data — JSON события)"""
+    for action in actions:
+        if action.action_type in EVENT_TYPES and action.data:
+            event = json.loads(action.data)
+            event.setdefault("type", action.action_type)
+            yield action.game_id, event
@@ -0,0 +1,464 @@
+"""
+Нагрузочное тестирование бэкенда Monopoly Telegram Bot.
+
+Запускает рой виртуальных пользователей Telegram: они создают игры,
+присоединяются по коду, начинают партию и играют ее через HTTP API
+с реалистичными паузами на обдумывание (логнормальное распределение).
+
+По умолчанию приложение поднимается в том же процессе через ASGI-транспорт
+httpx (сеть не нужна). С флагом --url нагрузка идет на уже запущенный
+локальный сервер (uvicorn app:app).
+
+В режиме in-process клиенты и сервер делят один процесс и один цикл:
+задержки запросов и лаг цикла включают CPU самих клиентов, так что это
+оценка для сравнения изменений, а не емкость сервера. Для цифр емкости —
+--url с генератором на отдельной машине или хотя бы в отдельном процессе.
+
+В отчете:
+- перцентили задержки и доля ошибок по каждому эндпоинту
+- задержка событийного цикла (в режиме in-process это общий цикл сервера и
+  всех виртуальных клиентов)
+- рост памяти процесса и число игр в движке во времени
+
+С --url собственные цикл и память генератора — не серверные. Память сервера
+замеряется по --server-pid (/proc/<pid>/statm, сервер на той же машине),
+лаг его цикла — из админ-API профилирования по --admin-token (на сервере
+должно быть включено профилирование, PROFILING_ENABLED=1). Без этих флагов
+в отчете остаются только метрики генератора с пометкой об этом.
+
+Примеры:
+    python loadtest.py --games 500 --players 4 --max-turns 60
+    python loadtest.py --url http://127.0.0.1:8000 --games 200 --json report.json
+    python loadtest.py --url http://127.0.0.1:8000 --server-pid 12345 --admin-token secret
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль по методу ближайшего ранга (значения уже отсортированы)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _current_rss_bytes(pid: Optional[int] = None) -> int:
+    """Текущий RSS процесса pid или своего (Linux /proc), иначе свой пиковый RSS"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        if pid is not None:
+            raise
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LatencyStats:
+    """Задержки и исходы запросов по эндпоинтам"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, outcome: str) -> None:
+        """outcome: ok, rejected (success=False от движка) или error (HTTP/сеть)"""
+        self.samples.setdefault(endpoint, []).append(seconds)
+        if outcome == "error":
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        elif outcome == "rejected":
+            self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+
+    def summary(self) -> Dict[str, Dict]:
+        result = {}
+        for endpoint, values in sorted(self.samples.items()):
+            values = sorted(values)
+            count = len(values)
+            errors = self.errors.get(endpoint, 0)
+            result[endpoint] = {
+                "count": count,
+                "errors": errors,
+                "error_rate": errors / count if count else 0.0,
+                "rejected": self.rejected.get(endpoint, 0),
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p90_ms": _percentile(values, 90) * 1000,
+                "p99_ms": _percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000 if values else 0.0,
+            }
+        return result
+
+
+class LoopLagMonitor:
+    """Замер задержки событийного цикла: насколько sleep просыпается позже срока"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: List[float] = []
+
+    async def run(self, stop: asyncio.Event) -> None:
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def summary(self) -> Dict[str, float]:
+        values = sorted(self.lags)
+        return {
+            "samples": len(values),
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0.0,
+        }
+
+
+class MemoryMonitor:
+    """Периодические снимки RSS (своего процесса или pid) и размера состояния движка"""
+
+    def __init__(self, interval: float, engine=None, pid: Optional[int] = None):
+        self.interval = interval
+        self.engine = engine
+        self.pid = pid
+        self.timeline: List[Dict] = []
+
+    def sample(self, started_at: float) -> None:
+        point = {
+            "elapsed_s": round(time.perf_counter() - started_at, 2),
+            "rss_mb": round(_current_rss_bytes(self.pid) / (1024 * 1024), 1),
+        }
+        if self.engine is not None:
+            point["games"] = len(self.engine.games)
+            point["log_entries"] = sum(len(g["game_log"]) for g in self.engine.games.values())
+        self.timeline.append(point)
+
+    async def run(self, stop: asyncio.Event, started_at: float) -> None:
+        while not stop.is_set():
+            self.sample(started_at)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self.sample(started_at)
+
+    def summary(self) -> Dict:
+        if not self.timeline:
+            return {"timeline": []}
+        return {
+            "start_rss_mb": self.timeline[0]["rss_mb"],
+            "end_rss_mb": self.timeline[-1]["rss_mb"],
+            "growth_mb": round(self.timeline[-1]["rss_mb"] - self.timeline[0]["rss_mb"], 1),
+            "timeline": self.timeline,
+        }
+
+
+class VirtualUser:
+    """Виртуальный пользователь Telegram, работающий через HTTP API"""
+
+    def __init__(self, client: httpx.AsyncClient, stats: LatencyStats, rng: random.Random,
+                 username: str, think_time: Callable[[random.Random], float]):
+        self.client = client
+        self.stats = stats
+        self.rng = rng
+        self.username = username
+        self.think_time = think_time
+        self.player_id: Optional[str] = None
+
+    async def call(self, endpoint: str, method: str, url: str, payload: Optional[Dict] = None) -> Optional[Dict]:
+        """Выполнить запрос и записать задержку; None при HTTP-ошибке"""
+        started = time.perf_counter()
+        data = None
+        try:
+            response = await self.client.request(method, url, json=payload)
+            if response.status_code < 400:
+                data = response.json()
+        except (httpx.HTTPError, ValueError):
+            data = None
+        elapsed = time.perf_counter() - started
+
+        if data is None:
+            outcome = "error"
+        elif data.get("success") is False:
+            outcome = "rejected"
+        else:
+            outcome = "ok"
+        self.stats.record(endpoint, elapsed, outcome)
+        return data
+
+    async def think(self) -> None:
+        await asyncio.sleep(self.think_time(self.rng))
+
+
+class GameSession:
+    """Одна партия: создание, сбор игроков, старт и игра до конца или лимита ходов"""
+
+    def __init__(self, index: int, client: httpx.AsyncClient, stats: LatencyStats,
+                 args: argparse.Namespace, deadline: float):
+        self.index = index
+        self.args = args
+        self.deadline = deadline
+        self.rng = random.Random(args.seed * 100003 + index)
+        think_time = _make_think_time(args.think_median, args.think_sigma)
+        self.users = [
+            VirtualUser(client, stats, random.Random(self.rng.random()), f"lt_{index}_{n}", think_time)
+            for n in range(args.players)
+        ]
+        self.game_id: Optional[str] = None
+        self.turns_played = 0
+        self.finished = False
+
+    def _should_stop(self) -> bool:
+        return (self.finished
+                or self.turns_played >= self.args.max_turns
+                or time.perf_counter() >= self.deadline)
+
+    async def run(self) -> None:
+        creator = self.users[0]
+        created = await creator.call("POST /api/games/create", "POST", "/api/games/create",
+                                     {"creator_username": creator.username,
+                                      "max_players": len(self.users)})
+        if not created:
+            return
+        self.game_id = created["game_id"]
+
+        await asyncio.gather(*(self._join(user, created["game_code"]) for user in self.users))
+        if any(user.player_id is None for user in self.users):
+            return
+
+        await creator.think()
+        started = await creator.call("POST /api/games/{id}/start", "POST",
+                                     f"/api/games/{self.game_id}/start")
+        if not started or not started.get("success"):
+            return
+
+        await asyncio.gather(*(self._play(user) for user in self.users))
+
+    async def _join(self, user: VirtualUser, game_code: str) -> None:
+        await user.think()
+        joined = await user.call("POST /api/games/join", "POST", "/api/games/join",
+                                 {"username": user.username, "game_code": game_code})
+        if joined and joined.get("success"):
+            user.player_id = joined["player_id"]
+
+    async def _play(self, user: VirtualUser) -> None:
+        """Клиент опрашивает состояние и ходит, когда наступает его очередь"""
+        while not self._should_stop():
+            await user.think()
+            state = await user.call("GET /api/games/{id}", "GET", f"/api/games/{self.game_id}")
+            if not state:
+                continue
+            if state["status"] == "finished":
+                self.finished = True
+                return
+            current = state["turn_order"][state["current_player_index"]]
+            if current == user.player_id and not self._should_stop():
+                me = next(p for p in state["players"] if p["id"] == user.player_id)
+                await self._take_turn(user, me["money"])
+
+    async def _take_turn(self, user: VirtualUser, money: int) -> None:
+        base = f"/api/games/{self.game_id}"
+        payload = {"player_id": user.player_id}
+        while True:
+            rolled = await user.call("POST /api/games/{id}/roll", "POST", f"{base}/roll", payload)
+            if not rolled or not rolled.get("success"):
+                break
+            action = rolled.get("action_result") or {}
+            if (action.get("action") == "can_buy" and money >= action["price"]
+                    and user.rng.random() < self.args.buy_probability):
+                await user.think()
+                bought = await user.call("POST /api/games/{id}/buy", "POST", f"{base}/buy",
+                                         {"player_id": user.player_id,
+                                          "position": rolled["new_position"]})
+                if bought and bought.get("success"):
+                    money -= bought["amount_paid"]
+            if not rolled.get("extra_turn"):
+                break
+            await user.think()
+        await user.call("POST /api/games/{id}/end-turn", "POST", f"{base}/end-turn", payload)
+        self.turns_played += 1
+
+
+def _make_think_time(median: float, sigma: float) -> Callable[[random.Random], float]:
+    """Логнормальное время на обдумывание с заданной медианой"""
+    if median <= 0:
+        return lambda rng: 0.0
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+def _make_client(args: argparse.Namespace):
+    """HTTP клиент и движок (только для in-process режима)"""
+    if args.url:
+        limits = httpx.Limits(max_connections=args.connections,
+                              max_keepalive_connections=args.connections)
+        return httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout), None
+
+    import app as backend_app
+    transport = httpx.ASGITransport(app=backend_app.app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout)
+    # Размер состояния доступен только у движка в процессе (не у роутера шардов)
+    engine = backend_app.game_engine if hasattr(backend_app.game_engine, "games") else None
+    return client, engine
+
+
+async def _server_loop_lag(client: httpx.AsyncClient, admin_token: str) -> Dict:
+    """Лаг цикла сервера из админ-API профилирования"""
+    try:
+        response = await client.get("/api/admin/profiling", params={"limit": 1},
+                                    headers={"X-Admin-Token": admin_token})
+        response.raise_for_status()
+        lag = response.json()["event_loop_lag"]
+    except httpx.HTTPStatusError as exc:
+        return {"error": f"HTTP {exc.response.status_code} от /api/admin/profiling"}
+    except (httpx.HTTPError, ValueError, KeyError) as exc:
+        return {"error": f"{type(exc).__name__}: {exc}"}
+    if not lag["samples"]:
+        return {"error": "на сервере выключено профилирование (PROFILING_ENABLED=1)"}
+    return lag
+
+
+async def run_load_test(args: argparse.Namespace) -> Dict:
+    """Запустить нагрузку и вернуть отчет"""
+    stats = LatencyStats()
+    client, engine = _make_client(args)
+    lag_monitor = LoopLagMonitor()
+    memory_monitor = MemoryMonitor(args.sample_interval, engine, args.server_pid)
+    # Чей цикл и чья память замеряются: в --url свои цикл и память — генератора
+    if not args.url:
+        lag_scope = memory_scope = "shared"
+    else:
+        lag_scope = "load_generator"
+        memory_scope = "server" if args.server_pid else "load_generator"
+    stop = asyncio.Event()
+
+    started_at = time.perf_counter()
+    deadline = started_at + args.duration
+    monitors = [
+        asyncio.create_task(lag_monitor.run(stop)),
+        asyncio.create_task(memory_monitor.run(stop, started_at)),
+    ]
+
+    async def ramped(session: GameSession) -> None:
+        # Равномерно размазываем старт партий по периоду разгона
+        await asyncio.sleep(args.ramp_up * session.index / max(1, args.games))
+        await session.run()
+
+    sessions = [GameSession(i, client, stats, args, deadline) for i in range(args.games)]
+    async with client:
+        await asyncio.gather(*(ramped(s) for s in sessions))
+        elapsed = time.perf_counter() - started_at
+        server_lag = await _server_loop_lag(client, args.admin_token) if args.url and args.admin_token else None
+
+    stop.set()
+    await asyncio.gather(*monitors)
+
+    endpoints = stats.summary()
+    total_requests = sum(e["count"] for e in endpoints.values())
+    total_errors = sum(e["errors"] for e in endpoints.values())
+    return {
+        "mode": "localhost" if args.url else "in-process",
+        "games": args.games,
+        "virtual_users": args.games * args.players,
+        "elapsed_s": round(elapsed, 2),
+        "games_finished": sum(1 for s in sessions if s.finished),
+        "turns_played": sum(s.turns_played for s in sessions),
+        "requests": total_requests,
+        "requests_per_s": round(total_requests / elapsed, 1) if elapsed else 0.0,
+        "error_rate": total_errors / total_requests if total_requests else 0.0,
+        "endpoints": endpoints,
+        "event_loop_lag": {"scope": lag_scope, **lag_monitor.summary()},
+        "server_event_loop_lag": server_lag,
+        "memory": {"scope": memory_scope, **memory_monitor.summary()},
+    }
+
+
+def format_report(report: Dict) -> str:
+    """Текстовый отчет для консоли"""
+    lines = [
+        f"Режим: {report['mode']}, игр: {report['games']}, пользователей: {report['virtual_users']}",
+        f"Время: {report['elapsed_s']} с, ходов: {report['turns_played']}, "
+        f"завершено игр: {report['games_finished']}",
+        f"Запросов: {report['requests']} ({report['requests_per_s']}/с), "
+        f"ошибок: {report['error_rate']:.2%}",
+        "",
+        f"{'endpoint':<32}{'count':>8}{'err%':>7}{'rej':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}",
+    ]
+    for endpoint, e in report["endpoints"].items():
+        lines.append(
+            f"{endpoint:<32}{e['count']:>8}{e['error_rate'] * 100:>7.2f}{e['rejected']:>6}"
+            f"{e['p50_ms']:>9.2f}{e['p90_ms']:>9.2f}{e['p99_ms']:>9.2f}{e['max_ms']:>9.2f}"
+        )
+    scopes = {"shared": "сервер и клиенты", "server": "сервер", "load_generator": "генератор нагрузки"}
+    lag = report["event_loop_lag"]
+    memory = report["memory"]
+    server_lag = report.get("server_event_loop_lag")
+    lines.append("")
+    if server_lag and "error" not in server_lag:
+        lines.append(f"Задержка цикла событий (сервер): p50 {server_lag['p50_ms']:.2f} мс, "
+                     f"p99 {server_lag['p99_ms']:.2f} мс, max {server_lag['max_ms']:.2f} мс")
+    elif server_lag:
+        lines.append(f"Задержка цикла событий сервера недоступна: {server_lag['error']}")
+    lines.append(f"Задержка цикла событий ({scopes[lag['scope']]}): p50 {lag['p50_ms']:.2f} мс, "
+                 f"p99 {lag['p99_ms']:.2f} мс, max {lag['max_ms']:.2f} мс")
+    if report["mode"] == "in-process":
+        lines.append("Внимание: in-process — задержки и лаг включают CPU виртуальных клиентов; "
+                     "для емкости сервера запускайте с --url")
+    if memory.get("timeline"):
+        lines.append(f"RSS ({scopes[memory['scope']]}): {memory['start_rss_mb']} → {memory['end_rss_mb']} МБ "
+                     f"(+{memory['growth_mb']} МБ)")
+    server_lag_measured = bool(server_lag) and "error" not in server_lag
+    if report["mode"] == "localhost" and (memory["scope"] != "server" or not server_lag_measured):
+        lines.append("Внимание: метрики с пометкой «генератор нагрузки» относятся к процессу генератора, "
+                     "а не сервера; для серверных укажите --server-pid и --admin-token")
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Monopoly API")
+    parser.add_argument("--url", help="адрес запущенного сервера; без него приложение поднимается в процессе")
+    parser.add_argument("--games", type=int, default=100, help="число параллельных партий")
+    parser.add_argument("--players", type=int, default=4, help="игроков в партии (2-6)")
+    parser.add_argument("--max-turns", type=int, default=40, help="лимит ходов на партию")
+    parser.add_argument("--duration", type=float, default=120.0, help="общий лимит времени, с")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="период разгона, с")
+    parser.add_argument("--think-median", type=float, default=0.5, help="медиана паузы, с")
+    parser.add_argument("--think-sigma", type=float, default=0.6, help="sigma логнормальной паузы")
+    parser.add_argument("--buy-probability", type=float, default=0.7)
+    parser.add_argument("--connections", type=int, default=200, help="пул соединений (--url)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="интервал замера памяти, с")
+    parser.add_argument("--server-pid", type=int, help="pid сервера для замера его RSS (--url, та же машина)")
+    parser.add_argument("--admin-token", help="ADMIN_TOKEN сервера: лаг его цикла из /api/admin/profiling (--url)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="сохранить отчет в JSON")
+    args = parser.parse_args(argv)
+    if not 2 <= args.players <= 6:
+        parser.error("--players должно быть от 2 до 6")
+    if (args.server_pid or args.admin_token) and not args.url:
+        parser.error("--server-pid и --admin-token имеют смысл только с --url")
+    if args.server_pid and not os.path.exists(f"/proc/{args.server_pid}/statm"):
+        parser.error(f"нет процесса {args.server_pid} в /proc (сервер должен работать на этой машине, Linux)")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(run_load_test(args))
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+"""
+Исходящие уведомления в Telegram по событиям игрового движка.
+
+Каждая запись _add_game_log превращается в строку для чатов, подписанных
+на игру. Отправлять по сообщению на строку нельзя: Telegram ограничивает
+~1 сообщение в секунду на чат и ~30 в секунду на бота. Поэтому:
+- строки копятся в буфере чата coalesce_window секунд и уходят одним сообщением
+- если последнее сообщение в чате свежее edit_window, оно дописывается
+  через editMessageText вместо нового сообщения
+- отправки планируются token bucket'ами на чат и глобально
+- 429 ждет retry_after, сетевые ошибки и 5xx повторяются с экспоненциальной задержкой
+- по событию game_finished подписки игры снимаются, а простаивающие чаты
+  без подписок удаляются — состояние не растет в долгоживущем процессе
+
+Проверка на локальной заглушке Bot API (сеть не нужна):
+    python notifications.py simulate --games 20 --turns 40
+"""
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class TelegramApiError(Exception):
+    """Ошибка Bot API; status=0 — сетевая ошибка"""
+
+    def __init__(self, status: int, description: str, retry_after: Optional[float] = None):
+        super().__init__(f"{status}: {description}")
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 0 or self.status == 429 or self.status >= 500
+
+
+class BotApiClient:
+    """Минимальный клиент Bot API поверх httpx"""
+
+    def __init__(self, token: str, base_url: str = TELEGRAM_API_URL,
+                 client: Optional[httpx.AsyncClient] = None, timeout: float = 10.0):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self._client = client or httpx.AsyncClient(timeout=timeout)
+
+    async def call(self, method: str, payload: Dict) -> Dict:
+        try:
+            response = await self._client.post(f"{self.base_url}/bot{self.token}/{method}", json=payload)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as exc:
+            raise TelegramApiError(0, str(exc))
+        if data.get("ok"):
+            return data["result"]
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        raise TelegramApiError(response.status_code, data.get("description", ""), retry_after)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления одного токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _ChatQueue:
+    """Буфер строк и состояние отправки одного чата"""
+
+    __slots__ = ("chat_id", "lines", "bucket", "scheduled", "sending",
+                 "last_message_id", "last_text", "last_sent_at")
+
+    def __init__(self, chat_id: int, bucket: TokenBucket):
+        self.chat_id = chat_id
+        self.lines: Deque[Tuple[str, float]] = deque()  # (текст, время постановки)
+        self.bucket = bucket
+        self.scheduled = False
+        self.sending = False
+        self.last_message_id: Optional[int] = None
+        self.last_text = ""
+        self.last_sent_at = 0.0
+
+
+class NotificationStats:
+    """Счетчики пайплайна; задержки — по последним latency_window строкам"""
+
+    def __init__(self, latency_window: int = 10000):
+        self.lines_in = 0
+        self.lines_delivered = 0
+        self.lines_failed = 0
+        self.messages_sent = 0
+        self.edits = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+
+    def summary(self) -> Dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[max(1, math.ceil(q / 100 * len(latencies))) - 1] * 1000
+
+        api_calls = self.messages_sent + self.edits
+        return {
+            "lines_in": self.lines_in,
+            "lines_delivered": self.lines_delivered,
+            "lines_failed": self.lines_failed,
+            "messages_sent": self.messages_sent,
+            "edits": self.edits,
+            "messages_saved": self.lines_delivered - self.messages_sent,
+            "api_calls_saved": self.lines_delivered - api_calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "latency_p50_ms": percentile(50),
+            "latency_p99_ms": percentile(99),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+
+class NotificationPipeline:
+    """Склейка строк лога по чатам и отправка в пределах лимитов Telegram"""
+
+    def __init__(self, api: BotApiClient, coalesce_window: float = 1.0, edit_window: float = 10.0,
+                 per_chat_rate: float = 1.0, per_chat_burst: float = 1.0,
+                 global_rate: float = 25.0, global_burst: float = 5.0,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_cap: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.api = api
+        self.coalesce_window = coalesce_window
+        self.edit_window = edit_window
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock)
+        self.stats = NotificationStats()
+
+        self.subscribers: Dict[str, Set[int]] = {}
+        self._chat_games: Dict[int, int] = {}  # chat_id -> число игр, на которые подписан
+        self.chats: Dict[int, _ChatQueue] = {}
+        self._heap: List[Tuple[float, int, int]] = []  # (когда, seq, chat_id)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+        self._senders: Set[asyncio.Task] = set()
+
+    def subscribe(self, game_id: str, chat_id: int) -> None:
+        chat_ids = self.subscribers.setdefault(game_id, set())
+        if chat_id not in chat_ids:
+            chat_ids.add(chat_id)
+            self._chat_games[chat_id] = self._chat_games.get(chat_id, 0) + 1
+
+    def unsubscribe(self, game_id: str, chat_id: Optional[int] = None) -> None:
+        chat_ids = self.subscribers.get(game_id)
+        if not chat_ids:
+            return
+        removed = set(chat_ids) if chat_id is None else chat_ids & {chat_id}
+        chat_ids -= removed
+        if not chat_ids:
+            del self.subscribers[game_id]
+        for removed_chat in removed:
+            self._chat_games[removed_chat] -= 1
+            if not self._chat_games[removed_chat]:
+                del self._chat_games[removed_chat]
+                self._prune(removed_chat)
+
+    def _prune(self, chat_id: int) -> None:
+        """Удалить состояние чата без подписок, если ему нечего отправлять"""
+        queue = self.chats.get(chat_id)
+        if (queue is not None and chat_id not in self._chat_games
+                and not queue.lines and not queue.scheduled and not queue.sending):
+            del self.chats[chat_id]
+
+    def handle_event(self, game_id: str, event: Dict) -> None:
+        """Слушатель событий движка: по окончании игры снять ее подписки"""
+        if event["type"] == "game_finished":
+            # Уже поставленные строки (в том числе о победителе) будут досланы
+            self.unsubscribe(game_id)
+
+    def publish(self, game_id: str, log_entry: Dict) -> None:
+        """Слушатель лога движка (MonopolyEngine.log_listeners)"""
+        chat_ids = self.subscribers.get(game_id)
+        if not chat_ids:
+            return
+        now = self.clock()
+        for chat_id in chat_ids:
+            queue = self.chats.get(chat_id)
+            if queue is None:
+                queue = self.chats[chat_id] = _ChatQueue(
+                    chat_id, TokenBucket(self.per_chat_rate, self.per_chat_burst, self.clock))
+            queue.lines.append((log_entry["message"], now))
+            self.stats.lines_in += 1
+            if not queue.scheduled and not queue.sending:
+                self._schedule(queue, now + self.coalesce_window)
+
+    def _schedule(self, queue: _ChatQueue, due: float) -> None:
+        heapq.heappush(self._heap, (due, next(self._seq), queue.chat_id))
+        queue.scheduled = True
+        self._wakeup.set()
+
+    def start(self) -> None:
+        self._running = True
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Дослать накопленное и остановиться"""
+        self._running = False
+        self._wakeup.set()
+        if self._task:
+            await self._task
+
+    async def run(self) -> None:
+        """Диспетчер: достает чаты по сроку и запускает отправку, если есть токены (запуск — start)"""
+        while self._running or self._heap or self._senders:
+            if not self._heap:
+                if not self._running:
+                    await asyncio.gather(*self._senders)
+                    continue
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, _, chat_id = self._heap[0]
+            now = self.clock()
+            # При остановке не ждем окна склейки, только лимиты
+            if due > now and self._running:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            queue = self.chats[chat_id]
+            queue.scheduled = False
+            if not queue.lines or queue.sending:
+                self._prune(chat_id)
+                continue
+            delay = max(queue.bucket.delay(now), self.global_bucket.delay(now))
+            if delay > 0:
+                self._schedule(queue, now + delay)
+                if not self._running:
+                    await asyncio.sleep(delay)
+                continue
+
+            queue.bucket.consume(now)
+            self.global_bucket.consume(now)
+            queue.sending = True
+            sender = asyncio.create_task(self._deliver(queue, self._take_batch(queue)))
+            self._senders.add(sender)
+            sender.add_done_callback(self._senders.discard)
+
+    def _take_batch(self, queue: _ChatQueue) -> List[Tuple[str, float]]:
+        """Строки, помещающиеся в одно сообщение"""
+        batch, length = [], 0
+        while queue.lines:
+            text, enqueued_at = queue.lines[0]
+            added = len(text) + (1 if batch else 0)
+            if batch and length + added > TELEGRAM_MESSAGE_LIMIT:
+                break
+            batch.append((text[:TELEGRAM_MESSAGE_LIMIT], enqueued_at))
+            length += added
+            queue.lines.popleft()
+        return batch
+
+    async def _acquire(self, queue: _ChatQueue) -> None:
+        """Дождаться токенов чата и глобального лимита"""
+        while True:
+            now = self.clock()
+            delay = max(queue.bucket.delay(now), self.global_bucket.delay(now))
+            if delay <= 0:
+                queue.bucket.consume(now)
+                self.global_bucket.consume(now)
+                return
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, queue: _ChatQueue, batch: List[Tuple[str, float]]) -> None:
+        text = "\n".join(line for line, _ in batch)
+        now = self.clock()
+        edit = (queue.last_message_id is not None
+                and now - queue.last_sent_at <= self.edit_window
+                and len(queue.last_text) + 1 + len(text) <= TELEGRAM_MESSAGE_LIMIT)
+        attempt = 0
+        try:
+            while True:
+                if edit:
+                    combined = f"{queue.last_text}\n{text}"
+                    method, payload = "editMessageText", {
+                        "chat_id": queue.chat_id, "message_id": queue.last_message_id, "text": combined}
+                else:
+                    method, payload = "sendMessage", {"chat_id": queue.chat_id, "text": text}
+                try:
+                    result = await self.api.call(method, payload)
+                    break
+                except TelegramApiError as exc:
+                    if edit and not exc.retryable:
+                        # Сообщение удалено или слишком старое — шлем новое
+                        edit = False
+                    elif not exc.retryable or attempt >= self.max_retries:
+                        logger.warning("Не удалось отправить уведомление в чат %s: %s", queue.chat_id, exc)
+                        self.stats.lines_failed += len(batch)
+                        return
+                    else:
+                        if exc.status == 429:
+                            self.stats.rate_limited += 1
+                            delay = exc.retry_after or self.backoff_base
+                        else:
+                            delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+                            delay *= 0.5 + random.random()
+                        attempt += 1
+                        self.stats.retries += 1
+                        await asyncio.sleep(delay)
+                    await self._acquire(queue)
+
+            delivered_at = self.clock()
+            if edit:
+                queue.last_text = combined
+                self.stats.edits += 1
+            else:
+                queue.last_message_id = result["message_id"]
+                queue.last_text = text
+                queue.last_sent_at = delivered_at
+                self.stats.messages_sent += 1
+            self.stats.lines_delivered += len(batch)
+            self.stats.latencies.extend(delivered_at - enqueued_at for _, enqueued_at in batch)
+        except Exception:
+            logger.exception("Ошибка отправки уведомления в чат %s", queue.chat_id)
+            self.stats.lines_failed += len(batch)
+        finally:
+            queue.sending = False
+            if queue.lines and not queue.scheduled:
+                self._schedule(queue, queue.lines[0][1] + self.coalesce_window)
+            self._prune(queue.chat_id)
+
+
+# --- Локальная заглушка Bot API и симуляция ----------------------------------
+
+class BotApiStub:
+    """Заглушка Bot API для httpx.MockTransport с лимитами как у Telegram"""
+
+    def __init__(self, per_chat_interval: float = 1.0, global_per_second: int = 30,
+                 failure_rate: float = 0.0, seed: int = 1):
+        self.per_chat_interval = per_chat_interval
+        self.global_per_second = global_per_second
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.messages: Dict[int, Dict[int, str]] = {}
+        self.calls = 0
+        self.rejected_429 = 0
+        self._message_ids = itertools.count(1)
+        self._last_by_chat: Dict[int, float] = {}
+        self._recent: Deque[float] = deque()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        method = request.url.path.rsplit("/", 1)[-1]
+        payload = json.loads(request.content)
+        chat_id = payload["chat_id"]
+        now = time.monotonic()
+
+        if self.rng.random() < self.failure_rate:
+            return httpx.Response(502, json={"ok": False, "description": "Bad Gateway"})
+
+        while self._recent and now - self._recent[0] >= 1.0:
+            self._recent.popleft()
+        since_last = now - self._last_by_chat.get(chat_id, -math.inf)
+        global_limited = len(self._recent) >= self.global_per_second
+        if global_limited or since_last < self.per_chat_interval * 0.9:
+            self.rejected_429 += 1
+            retry_after = 1 if global_limited else max(1, math.ceil(self.per_chat_interval - since_last))
+            return httpx.Response(429, json={
+                "ok": False, "description": "Too Many Requests: retry later",
+                "parameters": {"retry_after": retry_after}})
+        self._recent.append(now)
+        self._last_by_chat[chat_id] = now
+
+        chat = self.messages.setdefault(chat_id, {})
+        if method == "sendMessage":
+            message_id = next(self._message_ids)
+        elif method == "editMessageText":
+            message_id = payload["message_id"]
+            if message_id not in chat:
+                return httpx.Response(400, json={"ok": False, "description": "message to edit not found"})
+        else:
+            return httpx.Response(404, json={"ok": False, "description": "Not Found"})
+        chat[message_id] = payload["text"]
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": message_id, "text": payload["text"]}})
+
+
+async def simulate(args: argparse.Namespace) -> Dict:
+    """Партии на настоящем движке, лог уходит в пайплайн и заглушку Bot API"""
+    from game_engine import MonopolyEngine
+
+    stub = BotApiStub(failure_rate=args.failure_rate, seed=args.seed)
+    api = BotApiClient("stub-token", base_url="http://bot-api.local",
+                       client=httpx.AsyncClient(transport=stub.transport()))
+    pipeline = NotificationPipeline(api, coalesce_window=args.coalesce_window, edit_window=args.edit_window)
+    engine = MonopolyEngine()
+    engine.log_listeners.append(pipeline.publish)
+    engine.event_listeners.append(pipeline.handle_event)
+    pipeline.start()
+    rng = random.Random(args.seed)
+
+    async def play(index: int) -> None:
+        created = await engine.create_game(f"sim_{index}")
+        game_id = created["game_id"]
+        for n in range(args.players):
+            # Личный чат каждого игрока
+            pipeline.subscribe(game_id, index * 10 + n + 1)
+            await engine.join_game(f"sim_{index}_{n}", created["game_code"])
+        await engine.start_game(game_id)
+        game = engine.games[game_id]
+        for _ in range(args.turns):
+            if game["status"] == "finished":
+                break
+            player_id = game["turn_order"][game["current_player_index"]]
+            rolled = await engine.roll_dice(game_id, player_id)
+            action = rolled.get("action_result") or {}
+            if action.get("action") == "can_buy":
+                await engine.buy_property(game_id, player_id, rolled["new_position"])
+            await engine.end_turn(game_id, player_id)
+            await asyncio.sleep(rng.expovariate(1 / args.action_interval))
+
+    started = time.monotonic()
+    await asyncio.gather(*(play(i) for i in range(args.games)))
+    await pipeline.stop()
+    await api.close()
+
+    report = pipeline.stats.summary()
+    report.update({
+        "elapsed_s": round(time.monotonic() - started, 2),
+        "chats_open": len(pipeline.chats),
+        "api_calls": stub.calls,
+        "stub_429": stub.rejected_429,
+    })
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Уведомления Telegram")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sim = commands.add_parser("simulate", help="прогон на локальной заглушке Bot API")
+    sim.add_argument("--games", type=int, default=20)
+    sim.add_argument("--players", type=int, default=4)
+    sim.add_argument("--turns", type=int, default=40)
+    sim.add_argument("--action-interval", type=float, default=0.2, help="средняя пауза между ходами, с")
+    sim.add_argument("--coalesce-window", type=float, default=1.0)
+    sim.add_argument("--edit-window", type=float, default=10.0)
+    sim.add_argument("--failure-rate", type=float, default=0.02, help="доля ответов 502")
+    sim.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(simulate(args))
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {value:.2f}" if isinstance(value, float) else f"{key:<{width}}  {value}")
+
+
+if __name__ == "__main__":
+    main()
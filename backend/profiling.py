@@ -0,0 +1,460 @@
+"""
+Профилирование движка по играм: самые медленные вызовы, память, CPU, лаг цикла.
+
+Все выключено по умолчанию. EngineProfiler.enable() подменяет публичные
+методы движка (ENGINE_METHODS) на экземпляре обертками с замером времени,
+disable() удаляет обертки — выключенный профилировщик не стоит ничего:
+вызовы идут в исходные методы класса, фоновых задач нет.
+
+Во включенном состоянии:
+- последние вызовы (game_id, действие, длительность) в кольцевом буфере,
+  самые медленные из них и агрегаты по играм и действиям
+- при трассировке tracemalloc — изменение занятой памяти за вызов (нетто, с
+  учетом сборки мусора) по играм, размер состояния каждой игры, рост по
+  строкам кода с момента включения и снимок для tracemalloc.Snapshot.load
+- CPU-профиль за ограниченное окно: сэмплирующий (стеки цикла по SIGPROF в
+  формате folded для flamegraph.pl/speedscope, корень стека — игра и
+  действие) или детерминированный cProfile (.prof для pstats/snakeviz)
+- задержка событийного цикла
+
+Текущий вызов (игра и действие) хранится в contextvar, поэтому при
+ShardedEngine, где вызовы разных игр чередуются на await, и сэмплы, и
+длительности относятся к своей задаче; замеряется роутер (время с учетом IPC).
+
+Цена обертки во включенном и выключенном состоянии:
+    python profiling.py bench --calls 20000
+"""
+
+import argparse
+import asyncio
+import cProfile
+import heapq
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from game_engine import ENGINE_METHODS, MonopolyEngine
+
+# Первый аргумент этих методов — не game_id: id игры берется из результата
+_GAME_ID_FROM_RESULT = frozenset({"create_game", "join_game"})
+
+MAX_CPU_WINDOW = 60.0
+MAX_STACK_DEPTH = 64
+
+# (действие, game_id) вызова движка, выполняющегося в текущей задаче
+_current_call: ContextVar[Optional[Tuple[str, Optional[str]]]] = ContextVar("profiled_engine_call", default=None)
+
+
+class CallRecord:
+    """Один замеренный вызов движка"""
+
+    __slots__ = ("action", "game_id", "duration", "finished_at", "memory_delta")
+
+    def __init__(self, action: str, game_id: Optional[str], duration: float,
+                 finished_at: float, memory_delta: Optional[int]):
+        self.action = action
+        self.game_id = game_id
+        self.duration = duration
+        self.finished_at = finished_at
+        self.memory_delta = memory_delta
+
+    def to_dict(self) -> Dict:
+        record = {
+            "action": self.action,
+            "game_id": self.game_id,
+            "duration_ms": round(self.duration * 1000, 3),
+            "finished_at": self.finished_at,
+        }
+        if self.memory_delta is not None:
+            record["memory_delta_bytes"] = self.memory_delta
+        return record
+
+
+class CallAggregate:
+    """Счетчики вызовов по игре или действию"""
+
+    __slots__ = ("calls", "total", "max", "memory_delta")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.memory_delta: Optional[int] = None
+
+    def add(self, duration: float, memory_delta: Optional[int]) -> None:
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if memory_delta is not None:
+            self.memory_delta = (self.memory_delta or 0) + memory_delta
+
+    def to_dict(self) -> Dict:
+        aggregate = {
+            "calls": self.calls,
+            "total_ms": round(self.total * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+        if self.memory_delta is not None:
+            aggregate["memory_delta_bytes"] = self.memory_delta
+        return aggregate
+
+
+class LoopLagTracker:
+    """Задержка событийного цикла в скользящем окне последних замеров"""
+
+    def __init__(self, interval: float = 0.1, window: int = 1200):
+        self.interval = interval
+        self.lags: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def summary(self) -> Dict:
+        values = sorted(self.lags)
+        if not values:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(values),
+            "p50_ms": round(values[len(values) // 2] * 1000, 3),
+            "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+
+
+class StackSampler:
+    """Сэмплирующий профилировщик: стек главного потока по SIGPROF раз в interval процессорного времени
+
+    Сигнал, а не поток-сэмплер: поток получает GIL в основном тогда, когда цикл
+    его отпускает (в select), и видел бы простой вместо работы.
+    """
+
+    def __init__(self, interval: float, profiler: "EngineProfiler"):
+        self.interval = interval
+        self.profiler = profiler
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._previous_handler = None
+
+    def start(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("Сэмплирование доступно, только если цикл работает в главном потоке")
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        current = _current_call.get()
+        if current is not None:
+            action, game_id = current
+            stack.extend((action, f"game {game_id or '-'}"))
+        stack.reverse()
+        self.stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def folded(self) -> bytes:
+        """Формат folded: «кадр;кадр;...;кадр число» по строке на стек"""
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return ("\n".join(lines) + "\n").encode()
+
+
+class EngineProfiler:
+    """Включаемые по требованию замеры вызовов движка"""
+
+    def __init__(self, engine, recent: int = 2048, max_games: int = 1000):
+        self.engine = engine
+        self.enabled = False
+        self.recent: deque = deque(maxlen=recent)
+        # Агрегаты по играм в порядке последнего вызова; самые давние вытесняются
+        self.max_games = max_games
+        self.by_game: "OrderedDict[str, CallAggregate]" = OrderedDict()
+        self.games_evicted = 0
+        self.by_action: Dict[str, CallAggregate] = {}
+        self.loop_lag = LoopLagTracker()
+        self.enabled_at: Optional[float] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+        self._cpu_busy = False
+
+    def enable(self, memory: bool = False, frames: int = 1) -> None:
+        """Обернуть методы движка; memory=True — включить tracemalloc"""
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._started_tracing = True
+        if memory:
+            self._baseline = tracemalloc.take_snapshot()
+        if self.enabled:
+            return
+        self.recent.clear()
+        self.by_game.clear()
+        self.games_evicted = 0
+        self.by_action.clear()
+        for name in ENGINE_METHODS:
+            setattr(self.engine, name, self._wrap(name, getattr(self.engine, name)))
+        self.loop_lag.start()
+        self.enabled = True
+        self.enabled_at = time.time()
+
+    def disable(self) -> None:
+        """Вернуть исходные методы, остановить замер лага и свою трассировку"""
+        if self.enabled:
+            for name in ENGINE_METHODS:
+                # delattr, а не __dict__.pop: обращение к __dict__ лишает экземпляр
+                # компактного хранения атрибутов и замедляет сам движок
+                delattr(self.engine, name)
+            self.loop_lag.stop()
+            self.enabled = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._baseline = None
+
+    def _wrap(self, action: str, method):
+        from_result = action in _GAME_ID_FROM_RESULT
+
+        @wraps(method)
+        async def profiled(*args, **kwargs):
+            game_id = None if from_result else (args[0] if args else kwargs.get("game_id"))
+            tracing = tracemalloc.is_tracing()
+            traced_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+            token = _current_call.set((action, game_id))
+            started = time.perf_counter()
+            try:
+                result = await method(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - started
+                _current_call.reset(token)
+            memory_delta = tracemalloc.get_traced_memory()[0] - traced_before if tracing else None
+            if from_result and isinstance(result, dict):
+                game_id = result.get("game_id")
+            self._record(CallRecord(action, game_id, duration, time.time(), memory_delta))
+            return result
+
+        return profiled
+
+    def _record(self, record: CallRecord) -> None:
+        self.recent.append(record)
+        if record.game_id is not None:
+            aggregate = self.by_game.get(record.game_id)
+            if aggregate is None:
+                aggregate = self.by_game[record.game_id] = CallAggregate()
+                if len(self.by_game) > self.max_games:
+                    self.by_game.popitem(last=False)
+                    self.games_evicted += 1
+            else:
+                self.by_game.move_to_end(record.game_id)
+            aggregate.add(record.duration, record.memory_delta)
+        aggregate = self.by_action.get(record.action)
+        if aggregate is None:
+            aggregate = self.by_action[record.action] = CallAggregate()
+        aggregate.add(record.duration, record.memory_delta)
+
+    def slowest(self, limit: int = 20) -> List[Dict]:
+        """Самые медленные из последних вызовов"""
+        return [record.to_dict() for record in heapq.nlargest(limit, self.recent, key=lambda r: r.duration)]
+
+    def summary(self, limit: int = 20) -> Dict:
+        games = heapq.nlargest(limit, self.by_game.items(), key=lambda item: item[1].total)
+        return {
+            "enabled": self.enabled,
+            "enabled_at": self.enabled_at,
+            "memory_tracing": tracemalloc.is_tracing(),
+            "recent_calls": len(self.recent),
+            "games_evicted": self.games_evicted,
+            "slowest_calls": self.slowest(limit),
+            "games": [{"game_id": game_id, **aggregate.to_dict()} for game_id, aggregate in games],
+            "actions": {action: aggregate.to_dict() for action, aggregate in sorted(self.by_action.items())},
+            "event_loop_lag": self.loop_lag.summary(),
+        }
+
+    def memory_report(self, limit: int = 10) -> Dict:
+        """Память по играм: изменение за вызовы, размер состояния; рост по строкам кода"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc не запущен: включите профилирование с memory=true")
+        games = heapq.nlargest(limit, self.by_game.items(), key=lambda item: item[1].memory_delta or 0)
+        report = {
+            "traced_bytes": tracemalloc.get_traced_memory()[0],
+            "peak_bytes": tracemalloc.get_traced_memory()[1],
+            "games_by_memory_delta": [
+                {"game_id": game_id, "memory_delta_bytes": aggregate.memory_delta or 0, "calls": aggregate.calls}
+                for game_id, aggregate in games
+            ],
+        }
+        states = getattr(self.engine, "games", None)
+        if states is not None:
+            sizes = heapq.nlargest(limit, ((game_id, deep_sizeof(game)) for game_id, game in states.items()),
+                                   key=lambda item: item[1])
+            report["games_by_state_size"] = [{"game_id": game_id, "state_bytes": size} for game_id, size in sizes]
+        if self._baseline is not None:
+            growth = _own_traces_excluded(tracemalloc.take_snapshot()).compare_to(
+                _own_traces_excluded(self._baseline), "lineno")[:limit]
+            report["growth_since_enable"] = [
+                {"location": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in growth
+            ]
+        return report
+
+    def memory_snapshot(self) -> bytes:
+        """Снимок tracemalloc в формате Snapshot.dump"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc не запущен: включите профилирование с memory=true")
+        snapshot = tracemalloc.take_snapshot()
+        return _dump_to_bytes(snapshot.dump, ".tracemalloc")
+
+    async def cpu_profile(self, seconds: float, interval: float = 0.005, mode: str = "sampling") -> bytes:
+        """CPU-профиль потока цикла за окно seconds: folded (sampling) или .prof (cprofile)"""
+        if mode not in ("sampling", "cprofile"):
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        if not 0 < seconds <= MAX_CPU_WINDOW:
+            raise ValueError(f"Окно профилирования должно быть от 0 до {MAX_CPU_WINDOW:g} с")
+        if self._cpu_busy:
+            raise RuntimeError("CPU-профилирование уже идет")
+        self._cpu_busy = True
+        try:
+            if mode == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profile.disable()
+                return _dump_to_bytes(profile.dump_stats, ".prof")
+            sampler = StackSampler(interval, self)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+            return sampler.folded()
+        finally:
+            self._cpu_busy = False
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """Размер объекта со всеми вложенными dict/list/tuple/set"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def _own_traces_excluded(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    """Без аллокаций самого профилировщика (буфер вызовов, агрегаты)"""
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+
+
+def _dump_to_bytes(dump, suffix: str) -> bytes:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        dump(path)
+        with open(path, "rb") as file:
+            return file.read()
+    finally:
+        os.unlink(path)
+
+
+async def _play_calls(engine, calls: int) -> float:
+    """Секунд на вызов движка в цикле roll_dice/end_turn по одной партии"""
+    created = await engine.create_game("bench")
+    game_id = created["game_id"]
+    for username in ("alice", "bob"):
+        await engine.join_game(username, created["game_code"])
+    await engine.start_game(game_id)
+    game = engine.games[game_id]
+    done = 0
+    started = time.perf_counter()
+    while done < calls and game["status"] == "active":
+        player_id = game["turn_order"][game["current_player_index"]]
+        await engine.roll_dice(game_id, player_id)
+        await engine.end_turn(game_id, player_id)
+        done += 2
+    return (time.perf_counter() - started) / max(done, 1)
+
+
+async def run_benchmark(calls: int, repeat: int, seed: int) -> List[Tuple[str, float]]:
+    """(режим, мкс на вызов) — лучшее из repeat прогонов на свежих движках"""
+    modes = ("never enabled", "after disable", "enabled", "enabled + tracemalloc")
+
+    async def measure(mode: str) -> float:
+        random.seed(seed)  # одинаковая партия во всех режимах
+        engine = MonopolyEngine()
+        profiler = EngineProfiler(engine)
+        if mode == "after disable":
+            profiler.enable()
+            profiler.disable()
+        elif mode != "never enabled":
+            profiler.enable(memory=mode == "enabled + tracemalloc")
+        try:
+            return await _play_calls(engine, calls)
+        finally:
+            profiler.disable()
+
+    await measure("never enabled")  # прогрев
+    timings: Dict[str, List[float]] = {mode: [] for mode in modes}
+    for _ in range(repeat):
+        # Режимы чередуются, чтобы дрейф машины не ложился на один из них
+        for mode in modes:
+            timings[mode].append(await measure(mode))
+    return [(mode, min(timings[mode]) * 1e6) for mode in modes]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Профилирование движка по играм")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="цена профилирования на вызов движка")
+    bench.add_argument("--calls", type=int, default=20000)
+    bench.add_argument("--repeat", type=int, default=7)
+    bench.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rows = asyncio.run(run_benchmark(args.calls, args.repeat, args.seed))
+    baseline = rows[0][1]
+    print(f"{'mode':<26}{'µs/call':>10}{'overhead':>10}")
+    for mode, per_call in rows:
+        print(f"{mode:<26}{per_call:>10.2f}{(per_call / baseline - 1) * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
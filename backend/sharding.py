@@ -0,0 +1,591 @@
+"""
+Шардирование игр между процессами-воркерами MonopolyEngine.
+
+Один процесс с движком упирается в одно ядро, поэтому игры распределяются
+между N процессами-шардами:
+- game_id хешируется в один из NUM_SLOTS слотов, слоты раскладываются по
+  шардам консистентным хешированием (кольцо с виртуальными узлами)
+- код приглашения начинается с номера слота, поэтому /join по коду
+  маршрутизируется без поиска по всем шардам и не устаревает при ребалансировке
+- роутер (ShardedEngine) повторяет интерфейс MonopolyEngine и пересылает
+  вызовы владельцу игры через Unix-сокет (кадры: 4 байта длины + JSON)
+- при добавлении/удалении шарда игры переезжают снимками состояния
+  (бинарный формат state_codec в base64)
+
+Запуск:
+    python sharding.py shard --socket /tmp/monopoly/shard-0.sock
+    python sharding.py serve --shards 4 --socket-dir /tmp/monopoly
+    python sharding.py bench --max-shards 4 --duration 5
+"""
+
+import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from game_engine import ENGINE_METHODS, GAME_NOT_FOUND, MonopolyEngine
+from state_codec import GameSnapshot, decode_game, encode_game
+
+logger = logging.getLogger(__name__)
+
+NUM_SLOTS = 1000
+SLOT_DIGITS = 3
+CODE_SUFFIX_DIGITS = 5
+VIRTUAL_NODES = 64
+
+CALL_TIMEOUT = 10.0
+# Переезд снимков пачкой дольше обычного вызова, но тоже ограничен:
+# на время переезда маршрутизация закрыта для всех шардов
+MIGRATION_TIMEOUT = 60.0
+
+_HEADER = struct.Struct(">I")
+
+
+class ShardError(RuntimeError):
+    """Ошибка при выполнении вызова на шарде"""
+
+
+def _hash64(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def game_slot(game_id: str) -> int:
+    """Слот игры: хеш game_id по модулю NUM_SLOTS"""
+    return _hash64(game_id) % NUM_SLOTS
+
+
+def sharded_game_code(game_id: str) -> str:
+    """Код приглашения: номер слота + случайный суффикс"""
+    suffix = random.randrange(10 ** CODE_SUFFIX_DIGITS)
+    return f"{game_slot(game_id):0{SLOT_DIGITS}d}{suffix:0{CODE_SUFFIX_DIGITS}d}"
+
+
+def code_slot(game_code: str) -> Optional[int]:
+    """Слот из кода приглашения или None, если код не шардированный"""
+    if len(game_code) != SLOT_DIGITS + CODE_SUFFIX_DIGITS or not game_code.isdigit():
+        return None
+    return int(game_code[:SLOT_DIGITS])
+
+
+class HashRing:
+    """Консистентное хеширование слотов по шардам"""
+
+    def __init__(self, shards: Sequence[str], vnodes: int = VIRTUAL_NODES):
+        if not shards:
+            raise ValueError("Нужен хотя бы один шард")
+        self.shards = list(shards)
+        self.vnodes = vnodes
+        points = sorted((_hash64(f"{shard}#{i}"), shard) for shard in self.shards for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [shard for _, shard in points]
+        # Таблица слот -> шард: маршрутизация за O(1)
+        self.slot_table = [self._lookup(_hash64(f"slot-{slot}")) for slot in range(NUM_SLOTS)]
+
+    def _lookup(self, point: int) -> str:
+        index = bisect.bisect_right(self._hashes, point) % len(self._hashes)
+        return self._owners[index]
+
+    def shard_for_slot(self, slot: int) -> str:
+        return self.slot_table[slot]
+
+    def shard_for_game(self, game_id: str) -> str:
+        return self.slot_table[game_slot(game_id)]
+
+    def with_shards(self, shards: Sequence[str]) -> "HashRing":
+        return HashRing(shards, self.vnodes)
+
+
+# --- Протокол -----------------------------------------------------------------
+
+async def _read_frame(reader: asyncio.StreamReader) -> Dict:
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def _write_frame(writer: asyncio.StreamWriter, message: Dict) -> None:
+    payload = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+# --- Шард ---------------------------------------------------------------------
+
+async def _dispatch(engine: MonopolyEngine, method: str, args: List):
+    """Выполнить вызов роутера на движке шарда"""
+    if method in ENGINE_METHODS:
+        return await getattr(engine, method)(*args)
+    if method == "export_games":
+        slots = set(args[0])
+        return [base64.b64encode(encode_game(game)).decode()
+                for game in engine.games.values() if game_slot(game["id"]) in slots]
+    if method == "import_games":
+        for snapshot in args[0]:
+            game = decode_game(base64.b64decode(snapshot))
+            engine.games[game["id"]] = game
+        return len(args[0])
+    if method == "drop_games":
+        for game_id in args[0]:
+            engine.games.pop(game_id, None)
+        return len(args[0])
+    if method == "ping":
+        return {"games": len(engine.games), "pid": os.getpid()}
+    raise ShardError(f"Неизвестный метод: {method}")
+
+
+async def serve_shard(socket_path: str) -> None:
+    """Процесс-шард: движок за Unix-сокетом"""
+    engine = MonopolyEngine(code_generator=sharded_game_code)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await _read_frame(reader)
+                try:
+                    result = await _dispatch(engine, request["method"], request.get("args", []))
+                    response = {"id": request["id"], "result": result}
+                except Exception as exc:
+                    response = {"id": request["id"], "error": f"{type(exc).__name__}: {exc}"}
+                _write_frame(writer, response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    async with server:
+        await server.serve_forever()
+
+
+def spawn_shards(count: int, socket_dir: Optional[str] = None):
+    """Запустить count процессов-шардов; возвращает (процессы, пути сокетов)"""
+    socket_dir = socket_dir or tempfile.mkdtemp(prefix="monopoly-shards-")
+    os.makedirs(socket_dir, exist_ok=True)
+    processes, paths = [], []
+    for index in range(count):
+        path = os.path.join(socket_dir, f"shard-{index}.sock")
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "shard", "--socket", path]
+        ))
+        paths.append(path)
+    return processes, paths
+
+
+# --- Роутер -------------------------------------------------------------------
+
+class ShardConnection:
+    """Соединение роутера с одним шардом; запросы мультиплексируются по id"""
+
+    def __init__(self, address: str, call_timeout: float = CALL_TIMEOUT):
+        self.address = address
+        self.call_timeout = call_timeout
+        # Соединение разорвано или закрыто: роутер заменяет его новым
+        self.closed = False
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.address)
+                break
+            except OSError as exc:
+                # Шард может еще подниматься
+                if time.monotonic() >= deadline:
+                    raise ShardError(f"Шард {self.address} недоступен: {exc}") from exc
+                await asyncio.sleep(0.05)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self) -> None:
+        reason = "соединение закрыто"
+        try:
+            while True:
+                response = await _read_frame(self._reader)
+                future = self._pending.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(ShardError(response["error"]))
+                else:
+                    future.set_result(response["result"])
+        except (asyncio.IncompleteReadError, OSError, ValueError) as exc:
+            reason = f"{type(exc).__name__}: {exc}"
+        finally:
+            self._fail(reason)
+
+    def _fail(self, reason: str) -> None:
+        """Пометить соединение разорванным и завершить ожидающие вызовы ошибкой"""
+        self.closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ShardError(f"Шард {self.address} недоступен: {reason}"))
+        self._pending.clear()
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None):
+        """Вызов на шарде; разрыв соединения и таймаут — ShardError"""
+        if self.closed:
+            raise ShardError(f"Шард {self.address} недоступен: соединение разорвано")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            _write_frame(self._writer, {"id": request_id, "method": method, "args": list(args)})
+            await self._writer.drain()
+        except OSError as exc:
+            self._pending.pop(request_id, None)
+            self._fail(f"{type(exc).__name__}: {exc}")
+            raise ShardError(f"Шард {self.address} недоступен: {exc}") from exc
+        timeout = self.call_timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ShardError(f"Шард {self.address} не ответил на {method} за {timeout:g} с") from None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self) -> None:
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+        self._fail("соединение закрыто")
+
+
+class ShardedEngine:
+    """Роутер с интерфейсом MonopolyEngine поверх процессов-шардов"""
+
+    def __init__(self, addresses: Sequence[str], processes: Optional[List[subprocess.Popen]] = None,
+                 owns_topology: bool = True, call_timeout: float = CALL_TIMEOUT):
+        self.ring = HashRing(addresses)
+        self.connections: Dict[str, ShardConnection] = {}
+        self.call_timeout = call_timeout
+        self.processes = processes or []
+        # Кольцо хранится в памяти роутера: если к тем же шардам подключены другие
+        # роутеры, после ребалансировки они маршрутизировали бы по старому кольцу
+        self.owns_topology = owns_topology
+        self._connect_lock: Optional[asyncio.Lock] = None
+        # Маршрутизация приостанавливается на время переезда игр
+        self._routing_open: Optional[asyncio.Event] = None
+        self._inflight = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    @classmethod
+    def spawn(cls, count: int, socket_dir: Optional[str] = None) -> "ShardedEngine":
+        processes, paths = spawn_shards(count, socket_dir)
+        engine = cls(paths, processes)
+        # Шарды, запущенные роутером, не должны переживать его процесс
+        atexit.register(engine._terminate_processes)
+        return engine
+
+    async def _ensure_connected(self) -> None:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._routing_open = asyncio.Event()
+            self._routing_open.set()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        async with self._connect_lock:
+            for address in self.ring.shards:
+                if address not in self.connections:
+                    await self._connect(address)
+
+    async def _connect(self, address: str, timeout: float = 10.0) -> ShardConnection:
+        connection = ShardConnection(address, self.call_timeout)
+        await connection.connect(timeout)
+        self.connections[address] = connection
+        return connection
+
+    async def _connection(self, address: str) -> ShardConnection:
+        """Соединение с шардом; разорванное заменяется новым (шард мог перезапуститься)"""
+        connection = self.connections.get(address)
+        if connection is not None and not connection.closed:
+            return connection
+        async with self._connect_lock:
+            connection = self.connections.get(address)
+            if connection is not None and not connection.closed:
+                return connection
+            if connection is not None:
+                await self.connections.pop(address).close()
+            # Одна попытка: недоступный шард должен давать быстрый 503, а не ждать запуска
+            return await self._connect(address, timeout=0)
+
+    async def _call(self, method: str, *args, game_id: Optional[str] = None, slot: Optional[int] = None):
+        """Вызов на шарде-владельце слота (слот берется из game_id, если не задан)"""
+        if self._routing_open is None:
+            await self._ensure_connected()
+        if not self._routing_open.is_set():
+            await self._routing_open.wait()
+        if slot is None:
+            slot = game_slot(game_id)
+        connection = await self._connection(self.ring.shard_for_slot(slot))
+        self._inflight += 1
+        self._idle.clear()
+        try:
+            return await connection.call(method, *args)
+        finally:
+            self._inflight -= 1
+            if self._inflight == 0:
+                self._idle.set()
+
+    async def create_game(self, creator_username: str, max_players: int = 6) -> Dict:
+        game_id = str(uuid.uuid4())
+        return await self._call("create_game", creator_username, max_players, game_id, game_id=game_id)
+
+    async def join_game(self, username: str, game_code: str) -> Dict:
+        slot = code_slot(game_code)
+        if slot is None:
+            return {"success": False, "error": GAME_NOT_FOUND}
+        return await self._call("join_game", username, game_code, slot=slot)
+
+    async def has_game(self, game_id: str) -> bool:
+        return await self._call("has_game", game_id, game_id=game_id)
+
+    async def get_game_state(self, game_id: str) -> Optional[Dict]:
+        return await self._call("get_game_state", game_id, game_id=game_id)
+
+    async def start_game(self, game_id: str) -> Dict:
+        return await self._call("start_game", game_id, game_id=game_id)
+
+    async def roll_dice(self, game_id: str, player_id: str) -> Dict:
+        return await self._call("roll_dice", game_id, player_id, game_id=game_id)
+
+    async def buy_property(self, game_id: str, player_id: str, position: int) -> Dict:
+        return await self._call("buy_property", game_id, player_id, position, game_id=game_id)
+
+    async def mortgage_property(self, game_id: str, player_id: str, position: int) -> Dict:
+        return await self._call("mortgage_property", game_id, player_id, position, game_id=game_id)
+
+    async def unmortgage_property(self, game_id: str, player_id: str, position: int) -> Dict:
+        return await self._call("unmortgage_property", game_id, player_id, position, game_id=game_id)
+
+    async def end_turn(self, game_id: str, player_id: str) -> Dict:
+        return await self._call("end_turn", game_id, player_id, game_id=game_id)
+
+    async def change_buildings(self, game_id: str, player_id: str, levels: Dict[int, int]) -> Dict:
+        return await self._call("change_buildings", game_id, player_id, levels, game_id=game_id)
+
+    async def plan_build(self, game_id: str, player_id: str, budget: Optional[int] = None) -> Dict:
+        return await self._call("plan_build", game_id, player_id, budget, game_id=game_id)
+
+    def _check_topology_owner(self) -> None:
+        if not self.owns_topology:
+            raise ShardError("Роутер не владеет топологией шардов (общие ENGINE_SHARD_SOCKETS): "
+                             "ребалансировка оставила бы другие роутеры со старым кольцом")
+
+    async def add_shard(self, address: str) -> int:
+        """Подключить новый шард и перенести на него его слоты; возвращает число перенесенных игр"""
+        self._check_topology_owner()
+        await self._ensure_connected()
+        if address in self.ring.shards:
+            raise ShardError(f"Шард {address} уже подключен")
+        await self._connect(address)
+        try:
+            return await self._rebalance(self.ring.with_shards(self.ring.shards + [address]))
+        except Exception:
+            await self.connections.pop(address).close()
+            raise
+
+    async def remove_shard(self, address: str) -> int:
+        """Перенести игры с шарда на оставшиеся и отключить его"""
+        self._check_topology_owner()
+        await self._ensure_connected()
+        if address not in self.ring.shards:
+            raise ShardError(f"Шард {address} не подключен")
+        remaining = [shard for shard in self.ring.shards if shard != address]
+        if not remaining:
+            raise ShardError("Нельзя удалить последний шард")
+        moved = await self._rebalance(self.ring.with_shards(remaining))
+        await self.connections.pop(address).close()
+        return moved
+
+    async def _rebalance(self, new_ring: HashRing) -> int:
+        """Переезд снимков игр, чьи слоты сменили владельца.
+
+        Сначала все снимки копируются на новых владельцев, затем переключается
+        кольцо и только потом игры удаляются на старых шардах. Ошибка до
+        переключения откатывает импортированные копии: кольцо и исходные шарды
+        не меняются, игры не теряются.
+        """
+        self._routing_open.clear()
+        try:
+            await self._idle.wait()
+            moving: Dict[str, List[int]] = {}
+            for slot, (old, new) in enumerate(zip(self.ring.slot_table, new_ring.slot_table)):
+                if old != new:
+                    moving.setdefault(old, []).append(slot)
+
+            exported: Dict[str, List[str]] = {}
+            imported: Dict[str, List[str]] = {}
+            try:
+                for source, slots in moving.items():
+                    snapshots = await (await self._connection(source)).call(
+                        "export_games", slots, timeout=MIGRATION_TIMEOUT)
+                    # Роутеру нужен только id: декодируем одну секцию meta
+                    game_ids = [GameSnapshot(base64.b64decode(snapshot)).meta["id"] for snapshot in snapshots]
+                    exported[source] = game_ids
+                    by_target: Dict[str, List[Tuple[str, str]]] = {}
+                    for game_id, snapshot in zip(game_ids, snapshots):
+                        by_target.setdefault(new_ring.shard_for_game(game_id), []).append((game_id, snapshot))
+                    for target, batch in by_target.items():
+                        # Записываем до вызова: при сбое посреди пакета часть игр уже импортирована
+                        imported.setdefault(target, []).extend(game_id for game_id, _ in batch)
+                        await (await self._connection(target)).call(
+                            "import_games", [snapshot for _, snapshot in batch], timeout=MIGRATION_TIMEOUT)
+            except Exception:
+                for target, game_ids in imported.items():
+                    try:
+                        await (await self._connection(target)).call("drop_games", game_ids)
+                    except Exception:
+                        logger.exception("Не удалось откатить импорт на шарде %s", target)
+                raise
+
+            self.ring = new_ring
+            for source, game_ids in exported.items():
+                try:
+                    await (await self._connection(source)).call("drop_games", game_ids)
+                except Exception:
+                    # Копии не маршрутизируются и будут перезаписаны при обратном переезде
+                    logger.exception("Не удалось удалить перенесенные игры на шарде %s", source)
+            return sum(len(game_ids) for game_ids in exported.values())
+        finally:
+            self._routing_open.set()
+
+    async def shard_info(self) -> List[Dict]:
+        """Состояние шардов: адрес, число игр, pid"""
+        await self._ensure_connected()
+        return [{"address": address, **await (await self._connection(address)).call("ping")}
+                for address in self.ring.shards]
+
+    async def close(self) -> None:
+        for connection in self.connections.values():
+            await connection.close()
+        self.connections.clear()
+        self._terminate_processes()
+
+    def _terminate_processes(self) -> None:
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+# --- Бенчмарк -----------------------------------------------------------------
+
+async def _bench_client(addresses: List[str], duration: float, concurrency: int) -> int:
+    """Один процесс-клиент: партии по 4 игрока, ход = roll + end_turn + get_game_state"""
+    engine = ShardedEngine(addresses)
+    deadline = time.perf_counter() + duration
+    ops = 0
+
+    async def play() -> None:
+        nonlocal ops
+        while time.perf_counter() < deadline:
+            created = await engine.create_game("bench")
+            game_id = created["game_id"]
+            for n in range(4):
+                await engine.join_game(f"bench_{n}", created["game_code"])
+            await engine.start_game(game_id)
+            ops += 6
+            for _ in range(50):
+                if time.perf_counter() >= deadline:
+                    return
+                state = await engine.get_game_state(game_id)
+                current = state["turn_order"][state["current_player_index"]]
+                await engine.roll_dice(game_id, current)
+                await engine.end_turn(game_id, current)
+                ops += 3
+
+    await asyncio.gather(*(play() for _ in range(concurrency)))
+    await engine.close()
+    return ops
+
+
+def _bench_client_process(addresses: List[str], duration: float, concurrency: int, results) -> None:
+    results.put(asyncio.run(_bench_client(addresses, duration, concurrency)))
+
+
+def run_benchmark(max_shards: int, duration: float, concurrency: int) -> List[Dict]:
+    """Пропускная способность при 1..max_shards шардах (по одному процессу-клиенту на шард)"""
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    for count in range(1, max_shards + 1):
+        processes, paths = spawn_shards(count)
+        results = context.Queue()
+        clients = [context.Process(target=_bench_client_process,
+                                   args=(paths, duration, concurrency, results))
+                   for _ in range(count)]
+        for client in clients:
+            client.start()
+        total_ops = sum(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+        for process in processes:
+            process.terminate()
+            process.wait()
+        ops_per_s = total_ops / duration
+        rows.append({
+            "shards": count,
+            "ops_per_s": round(ops_per_s),
+            "speedup": round(ops_per_s / rows[0]["ops_per_s"], 2) if rows else 1.0,
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Шарды MonopolyEngine")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    shard = commands.add_parser("shard", help="запустить один шард")
+    shard.add_argument("--socket", required=True)
+
+    serve = commands.add_parser("serve", help="запустить N шардов для внешних роутеров")
+    serve.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    serve.add_argument("--socket-dir", default="/tmp/monopoly-shards")
+
+    bench = commands.add_parser("bench", help="масштабирование пропускной способности по шардам")
+    bench.add_argument("--max-shards", type=int, default=os.cpu_count() or 1)
+    bench.add_argument("--duration", type=float, default=5.0)
+    bench.add_argument("--concurrency", type=int, default=32, help="параллельных партий на клиента")
+
+    args = parser.parse_args(argv)
+    if args.command == "shard":
+        asyncio.run(serve_shard(args.socket))
+    elif args.command == "serve":
+        processes, paths = spawn_shards(args.shards, args.socket_dir)
+        print(f"ENGINE_SHARD_SOCKETS={','.join(paths)}", flush=True)
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+    elif args.command == "bench":
+        print(f"{'shards':>6}{'ops/s':>12}{'speedup':>10}")
+        for row in run_benchmark(args.max_shards, args.duration, args.concurrency):
+            print(f"{row['shards']:>6}{row['ops_per_s']:>12}{row['speedup']:>10}")
+
+
+if __name__ == "__main__":
+    main()
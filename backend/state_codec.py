@@ -0,0 +1,530 @@
+"""
+Компактный бинарный формат состояния игры для снимков, кэша и IPC.
+
+JSON полного состояния тяжелый: UUID строками, ISO-время в каждой записи
+лога, повторяющиеся ключи. Формат v2:
+- заголовок: MAGIC, версия формата, таблица секций (id, длина)
+- секции meta / players / properties / log / extra декодируются лениво
+  (GameSnapshot), например только meta для списка игр
+- UUID пишутся 16 байтами, id игроков интернируются в индексы 0..N-1
+- состояние клетки — один байт: владелец (3 бита), дома (3), отель (1), залог (1);
+  все 40 клеток поля — фиксированные 40 байт
+- строки — длина varint + UTF-8, поэтому любой текст (с NUL, длинный)
+  кодируется без ограничений
+- время лога — дельты в микросекундах (varint) от предыдущей записи,
+  сообщения — длины в символах (varint) и один блок UTF-8
+- неизвестные ключи верхнего уровня уходят в секцию extra (JSON), так что
+  новые поля состояния не ломают формат до следующей версии
+
+    data = encode_game(game)
+    game == decode_game(data)
+    GameSnapshot(data).meta["status"]
+
+Сравнение с JSON на поздних стадиях игры:
+    python state_codec.py bench --games 50
+"""
+
+import argparse
+import json
+import struct
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from game_engine import PLAYER_COLORS, MonopolyEngine
+
+MAGIC = b"MGS"
+FORMAT_VERSION = 2
+
+SECTION_META = 1
+SECTION_PLAYERS = 2
+SECTION_PROPERTIES = 3
+SECTION_LOG = 4
+SECTION_EXTRA = 5
+
+STATUSES = ("waiting", "active", "finished")
+BOARD_SIZE = 40
+MAX_PLAYERS = 7  # владелец клетки хранится в 3 битах, 0 — нет владельца
+
+_GAME_KEYS = ("id", "code", "creator", "status", "max_players", "current_player_index",
+              "created_at", "players", "properties", "houses_remaining", "hotels_remaining",
+              "turn_order", "game_log")
+_PLAYER_KEYS = frozenset({"id", "username", "position", "money", "color", "is_in_jail", "jail_turns",
+                          "consecutive_doubles", "has_get_out_card", "is_bankrupt", "properties"})
+
+_FLAG_IN_JAIL = 1
+_FLAG_GET_OUT_CARD = 2
+_FLAG_BANKRUPT = 4
+_FLAG_EXTRA = 8
+
+_HEADER = struct.Struct("<3sBB")
+_SECTION_ENTRY = struct.Struct("<BI")
+_META_FIXED = struct.Struct("<BBBqHH")
+_PLAYER_FIXED = struct.Struct("<BiBBBBB")
+_LOG_HEAD = struct.Struct("<Hq")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+# --- Примитивы ----------------------------------------------------------------
+
+def _utf8(value: str) -> bytes:
+    # surrogatepass: строки из JSON API могут содержать одиночные суррогаты
+    return value.encode("utf-8", "surrogatepass")
+
+
+def _from_utf8(raw: bytes) -> str:
+    return raw.decode("utf-8", "surrogatepass")
+
+
+def _pack_str(out: bytearray, value: str) -> None:
+    raw = _utf8(value)
+    _pack_uvarint(out, len(raw))
+    out += raw
+
+
+def _unpack_str(data: memoryview, offset: int) -> Tuple[str, int]:
+    length, offset = _unpack_uvarint(data, offset)
+    return _from_utf8(bytes(data[offset:offset + length])), offset + length
+
+
+def _pack_id(out: bytearray, value: str) -> None:
+    """UUID в каноничной записи — 16 байт, иначе строкой"""
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        parsed = None
+    if parsed is not None and str(parsed) == value:
+        out.append(0)
+        out += parsed.bytes
+    else:
+        out.append(1)
+        _pack_str(out, value)
+
+
+def _unpack_id(data: memoryview, offset: int) -> Tuple[str, int]:
+    if data[offset] == 0:
+        return str(uuid.UUID(bytes=bytes(data[offset + 1:offset + 17]))), offset + 17
+    return _unpack_str(data, offset + 1)
+
+
+def _pack_uvarint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _unpack_uvarint(data: memoryview, offset: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _pack_varint(out: bytearray, value: int) -> None:
+    _pack_uvarint(out, (value << 1) ^ (value >> 63))  # zigzag: дельты бывают отрицательными
+
+
+def _unpack_varint(data: memoryview, offset: int) -> Tuple[int, int]:
+    result, offset = _unpack_uvarint(data, offset)
+    return (result >> 1) ^ -(result & 1), offset
+
+
+def _timestamp_us(value: str) -> int:
+    """ISO-время движка (naive UTC) в микросекунды от эпохи"""
+    return (datetime.fromisoformat(value) - _EPOCH) // _MICROSECOND
+
+
+def _timestamp_iso(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+# --- Кодирование --------------------------------------------------------------
+
+# Поля meta фиксированной ширины: (ключ, максимум)
+_META_LIMITS = (("max_players", 0xFF), ("current_player_index", 0xFF),
+                ("houses_remaining", 0xFFFF), ("hotels_remaining", 0xFFFF))
+
+
+def _encode_meta(game: Dict, player_index: Dict[str, int]) -> bytes:
+    for key, limit in _META_LIMITS:
+        if not 0 <= game[key] <= limit:
+            raise ValueError(f"{key}={game[key]} вне диапазона формата 0..{limit}")
+    out = bytearray()
+    _pack_id(out, game["id"])
+    _pack_str(out, game["code"])
+    _pack_str(out, game["creator"])
+    out += _META_FIXED.pack(STATUSES.index(game["status"]), game["max_players"],
+                            game["current_player_index"], _timestamp_us(game["created_at"]),
+                            game["houses_remaining"], game["hotels_remaining"])
+    out.append(len(game["turn_order"]))
+    out += bytes(player_index[player_id] for player_id in game["turn_order"])
+    return bytes(out)
+
+
+def _encode_players(players: List[Dict]) -> bytes:
+    out = bytearray()
+    out.append(len(players))
+    # Сначала все id подряд: meta и properties декодируют только их
+    for player in players:
+        _pack_id(out, player["id"])
+    for player in players:
+        extra = {key: value for key, value in player.items() if key not in _PLAYER_KEYS}
+        flags = ((_FLAG_IN_JAIL if player["is_in_jail"] else 0)
+                 | (_FLAG_GET_OUT_CARD if player["has_get_out_card"] else 0)
+                 | (_FLAG_BANKRUPT if player["is_bankrupt"] else 0)
+                 | (_FLAG_EXTRA if extra else 0))
+        color = player["color"]
+        color_index = PLAYER_COLORS.index(color) if color in PLAYER_COLORS else 0xFF
+        _pack_str(out, player["username"])
+        out += _PLAYER_FIXED.pack(player["position"], player["money"], color_index, flags,
+                                  player["jail_turns"], player["consecutive_doubles"],
+                                  len(player["properties"]))
+        out += bytes(player["properties"])
+        if color_index == 0xFF:
+            _pack_str(out, color)
+        if extra:
+            _pack_str(out, json.dumps(extra, ensure_ascii=False))
+    return bytes(out)
+
+
+def _encode_properties(properties: Dict[str, Dict], player_index: Dict[str, int]) -> bytes:
+    squares = bytearray(BOARD_SIZE)
+    for position, info in properties.items():
+        houses, hotels = info["houses"], info["hotels"]
+        if not 0 <= houses <= 4 or not 0 <= hotels <= 1:
+            raise ValueError(f"Недопустимая застройка клетки {position}: {houses} домов, {hotels} отелей")
+        squares[int(position)] = ((player_index[info["owner_id"]] + 1)
+                                  | houses << 3 | hotels << 6 | (0x80 if info["mortgaged"] else 0))
+    return bytes(squares)
+
+
+def _encode_log(game_log: List[Dict]) -> bytes:
+    out = bytearray()
+    timestamps = [_timestamp_us(entry["timestamp"]) for entry in game_log]
+    out += _LOG_HEAD.pack(len(game_log), timestamps[0] if timestamps else 0)
+    previous = timestamps[0] if timestamps else 0
+    for timestamp in timestamps:
+        _pack_varint(out, timestamp - previous)
+        previous = timestamp
+    for entry in game_log:
+        if len(entry) != 2:
+            raise ValueError(f"Неизвестные поля записи лога: {sorted(entry)}")
+        length = len(entry["message"])
+        if length < 0x80:
+            out.append(length)
+        else:
+            _pack_uvarint(out, length)
+    # Сообщения одним блоком: декодируются одним decode и режутся по длинам в символах
+    out += _utf8("".join(entry["message"] for entry in game_log))
+    return bytes(out)
+
+
+def encode_game(game: Dict) -> bytes:
+    """Закодировать состояние игры (словарь MonopolyEngine.games[game_id])"""
+    if len(game["players"]) > MAX_PLAYERS:
+        raise ValueError(f"Формат поддерживает не больше {MAX_PLAYERS} игроков")
+    player_index = {player["id"]: index for index, player in enumerate(game["players"])}
+    try:
+        sections = [
+            (SECTION_META, _encode_meta(game, player_index)),
+            (SECTION_PLAYERS, _encode_players(game["players"])),
+            (SECTION_PROPERTIES, _encode_properties(game["properties"], player_index)),
+            (SECTION_LOG, _encode_log(game["game_log"])),
+        ]
+    except struct.error as exc:
+        # Остальные поля фиксированной ширины (деньги, позиции)
+        raise ValueError(f"Состояние игры {game['id']} не помещается в формат: {exc}") from exc
+    extra = {key: value for key, value in game.items() if key not in _GAME_KEYS}
+    if extra:
+        sections.append((SECTION_EXTRA, _utf8(json.dumps(extra, ensure_ascii=False))))
+
+    out = bytearray(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+    for section_id, payload in sections:
+        out += _SECTION_ENTRY.pack(section_id, len(payload))
+    for _, payload in sections:
+        out += payload
+    return bytes(out)
+
+
+# --- Декодирование ------------------------------------------------------------
+
+class GameSnapshot:
+    """Ленивое чтение закодированного состояния: секции декодируются при обращении"""
+
+    def __init__(self, data: bytes):
+        view = memoryview(data)
+        magic, version, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Это не снимок состояния игры")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {version}")
+        self.version = version
+        offset = _HEADER.size
+        entries = [_SECTION_ENTRY.unpack_from(view, offset + i * _SECTION_ENTRY.size) for i in range(count)]
+        offset += count * _SECTION_ENTRY.size
+        self._sections: Dict[int, memoryview] = {}
+        for section_id, length in entries:
+            self._sections[section_id] = view[offset:offset + length]
+            offset += length
+        self._cache: Dict[str, object] = {}
+
+    def _cached(self, name: str, decode):
+        if name not in self._cache:
+            self._cache[name] = decode()
+        return self._cache[name]
+
+    @property
+    def player_ids(self) -> List[str]:
+        def decode():
+            data = self._sections[SECTION_PLAYERS]
+            ids, offset = [], 1
+            for _ in range(data[0]):
+                player_id, offset = _unpack_id(data, offset)
+                ids.append(player_id)
+            self._cache["players_offset"] = offset
+            return ids
+        return self._cached("player_ids", decode)
+
+    @property
+    def meta(self) -> Dict:
+        """Все поля верхнего уровня, кроме players / properties / game_log"""
+        def decode():
+            data = self._sections[SECTION_META]
+            game_id, offset = _unpack_id(data, 0)
+            code, offset = _unpack_str(data, offset)
+            creator, offset = _unpack_str(data, offset)
+            (status, max_players, current_player_index, created_at,
+             houses_remaining, hotels_remaining) = _META_FIXED.unpack_from(data, offset)
+            offset += _META_FIXED.size
+            ids = self.player_ids
+            turn_order = [ids[index] for index in data[offset + 1:offset + 1 + data[offset]]]
+            return {
+                "id": game_id,
+                "code": code,
+                "creator": creator,
+                "status": STATUSES[status],
+                "max_players": max_players,
+                "current_player_index": current_player_index,
+                "created_at": _timestamp_iso(created_at),
+                "houses_remaining": houses_remaining,
+                "hotels_remaining": hotels_remaining,
+                "turn_order": turn_order,
+            }
+        return self._cached("meta", decode)
+
+    @property
+    def players(self) -> List[Dict]:
+        def decode():
+            ids = self.player_ids
+            data = self._sections[SECTION_PLAYERS]
+            offset = self._cache["players_offset"]
+            players = []
+            for player_id in ids:
+                username, offset = _unpack_str(data, offset)
+                (position, money, color_index, flags, jail_turns,
+                 consecutive_doubles, owned) = _PLAYER_FIXED.unpack_from(data, offset)
+                offset += _PLAYER_FIXED.size
+                properties = list(data[offset:offset + owned])
+                offset += owned
+                if color_index == 0xFF:
+                    color, offset = _unpack_str(data, offset)
+                else:
+                    color = PLAYER_COLORS[color_index]
+                player = {
+                    "id": player_id,
+                    "username": username,
+                    "position": position,
+                    "money": money,
+                    "color": color,
+                    "is_in_jail": bool(flags & _FLAG_IN_JAIL),
+                    "jail_turns": jail_turns,
+                    "consecutive_doubles": consecutive_doubles,
+                    "has_get_out_card": bool(flags & _FLAG_GET_OUT_CARD),
+                    "is_bankrupt": bool(flags & _FLAG_BANKRUPT),
+                    "properties": properties,
+                }
+                if flags & _FLAG_EXTRA:
+                    extra, offset = _unpack_str(data, offset)
+                    player.update(json.loads(extra))
+                players.append(player)
+            return players
+        return self._cached("players", decode)
+
+    @property
+    def properties(self) -> Dict[str, Dict]:
+        def decode():
+            ids = self.player_ids
+            properties = {}
+            for position, packed in enumerate(self._sections[SECTION_PROPERTIES]):
+                if packed:
+                    properties[str(position)] = {
+                        "owner_id": ids[(packed & 0x07) - 1],
+                        "houses": (packed >> 3) & 0x07,
+                        "hotels": (packed >> 6) & 0x01,
+                        "mortgaged": bool(packed & 0x80),
+                    }
+            return properties
+        return self._cached("properties", decode)
+
+    @property
+    def game_log(self) -> List[Dict]:
+        def decode():
+            data = self._sections[SECTION_LOG]
+            count, timestamp = _LOG_HEAD.unpack_from(data, 0)
+            offset = _LOG_HEAD.size
+            timestamps = []
+            last_second, prefix = None, ""
+            for _ in range(count):
+                if data[offset] < 0x80:
+                    raw = data[offset]
+                    offset += 1
+                    delta = (raw >> 1) ^ -(raw & 1)
+                else:
+                    delta, offset = _unpack_varint(data, offset)
+                timestamp += delta
+                # Записи одного хода попадают в одну секунду: форматируем секунду один раз
+                second, microsecond = divmod(timestamp, 1_000_000)
+                if second != last_second:
+                    last_second, prefix = second, _timestamp_iso(second * 1_000_000)
+                timestamps.append(f"{prefix}.{microsecond:06d}" if microsecond else prefix)
+            ends, end = [], 0
+            for _ in range(count):
+                if data[offset] < 0x80:
+                    length = data[offset]
+                    offset += 1
+                else:
+                    length, offset = _unpack_uvarint(data, offset)
+                end += length
+                ends.append(end)
+            text = _from_utf8(bytes(data[offset:]))
+            return [{"timestamp": ts, "message": text[start:end]}
+                    for ts, start, end in zip(timestamps, [0] + ends, ends)]
+        return self._cached("game_log", decode)
+
+    @property
+    def extra(self) -> Dict:
+        def decode():
+            data = self._sections.get(SECTION_EXTRA)
+            return json.loads(_from_utf8(bytes(data))) if data is not None else {}
+        return self._cached("extra", decode)
+
+    def to_dict(self) -> Dict:
+        meta = self.meta
+        game = {
+            "id": meta["id"],
+            "code": meta["code"],
+            "creator": meta["creator"],
+            "status": meta["status"],
+            "max_players": meta["max_players"],
+            "current_player_index": meta["current_player_index"],
+            "created_at": meta["created_at"],
+            "players": self.players,
+            "properties": self.properties,
+            "houses_remaining": meta["houses_remaining"],
+            "hotels_remaining": meta["hotels_remaining"],
+            "turn_order": meta["turn_order"],
+            "game_log": self.game_log,
+        }
+        game.update(self.extra)
+        return game
+
+
+def decode_game(data: bytes) -> Dict:
+    """Полностью декодировать состояние игры"""
+    return GameSnapshot(data).to_dict()
+
+
+# --- Бенчмарк -----------------------------------------------------------------
+
+async def _late_game_states(count: int, turns: int, seed: int) -> List[Dict]:
+    """Партии, доигранные до поздней стадии: все куплено, монополии застроены, часть в залоге"""
+    import random
+
+    random.seed(seed)
+    engine = MonopolyEngine()
+    for index in range(count):
+        created = await engine.create_game(f"Игрок_{index}_создатель")
+        game_id = created["game_id"]
+        for n in range(random.randint(3, 6)):
+            await engine.join_game(f"Игрок_{index}_{n}", created["game_code"])
+        await engine.start_game(game_id)
+        game = engine.games[game_id]
+        for _ in range(turns):
+            player_id = game["turn_order"][game["current_player_index"]]
+            rolled = await engine.roll_dice(game_id, player_id)
+            if (rolled.get("action_result") or {}).get("action") == "can_buy":
+                await engine.buy_property(game_id, player_id, rolled["new_position"])
+            await engine.end_turn(game_id, player_id)
+        for position, info in game["properties"].items():
+            square = engine.board_squares[int(position)]
+            if square["type"] == "property" and engine._has_monopoly(game, info["owner_id"], square["group"]):
+                info["houses"] = random.randint(1, 4)
+            elif random.random() < 0.2:
+                info["mortgaged"] = True
+    return list(engine.games.values())
+
+
+def _time_per_call(func, items, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            func(item)
+    return (time.perf_counter() - started) / (repeat * len(items)) * 1e6
+
+
+def run_benchmark(games: int, turns: int, repeat: int, seed: int) -> List[Tuple[str, float, float, float]]:
+    """(формат, средний размер в байтах, encode мкс, decode мкс)"""
+    import asyncio
+
+    states = asyncio.run(_late_game_states(games, turns, seed))
+    for state in states:
+        assert decode_game(encode_game(state)) == state
+
+    def json_utf8(state):
+        return json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def json_ascii(state):
+        return json.dumps(state).encode()
+
+    rows = []
+    for name, encode, decode in (
+        ("json (ensure_ascii)", json_ascii, json.loads),
+        ("json (utf-8)", json_utf8, json.loads),
+        ("binary v2", encode_game, decode_game),
+        ("binary v2, только meta", encode_game, lambda data: GameSnapshot(data).meta),
+    ):
+        encoded = [encode(state) for state in states]
+        rows.append((
+            name,
+            sum(len(data) for data in encoded) / len(encoded),
+            _time_per_call(encode, states, repeat),
+            _time_per_call(decode, encoded, repeat),
+        ))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Бинарный формат состояния игры")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="размер и скорость против JSON")
+    bench.add_argument("--games", type=int, default=50)
+    bench.add_argument("--turns", type=int, default=200, help="ходов в каждой партии")
+    bench.add_argument("--repeat", type=int, default=20)
+    bench.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{'format':<26}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}")
+    for name, size, encode_us, decode_us in run_benchmark(args.games, args.turns, args.repeat, args.seed):
+        print(f"{name:<26}{size:>10.0f}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
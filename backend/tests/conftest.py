@@ -0,0 +1,42 @@
+"""
+Общие фикстуры тестов бэкенда.
+
+Модули бэкенда импортируются плоско (from game_engine import ...), как в app.py,
+поэтому каталог backend добавляется в sys.path.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_engine import MonopolyEngine  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Выполнить корутину в отдельном цикле событий"""
+    return asyncio.run
+
+
+@pytest.fixture
+def engine():
+    return MonopolyEngine()
+
+
+@pytest.fixture
+def game(engine, run):
+    """Начатая игра на двоих: (game_id, id игроков в порядке хода)"""
+
+    async def setup():
+        created = await engine.create_game("alice")
+        for username in ("alice", "bob"):
+            await engine.join_game(username, created["game_code"])
+        await engine.start_game(created["game_id"])
+        return created["game_id"]
+
+    game_id = run(setup())
+    return game_id, list(engine.games[game_id]["turn_order"])
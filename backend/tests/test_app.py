@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+
+import app
+
+
+def test_action_on_missing_game_is_404():
+    client = TestClient(app.app)
+    response = client.post("/api/games/missing/roll", json={"player_id": "p"})
+    assert response.status_code == 404
+
+
+def test_engine_errors_are_returned_as_is():
+    client = TestClient(app.app)
+    game_id = client.post("/api/games/create", json={"creator_username": "alice"}).json()["game_id"]
+    response = client.post(f"/api/games/{game_id}/roll", json={"player_id": "p"})
+    assert response.status_code == 200
+    assert response.json() == {"success": False, "error": "Игра не идет"}
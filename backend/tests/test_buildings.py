@@ -0,0 +1,154 @@
+import itertools
+
+import pytest
+
+
+@pytest.fixture
+def owner(engine, game):
+    """Игра, где первый игрок владеет коричневой и голубой группами"""
+    game_id, (player_id, _) = game
+    state = engine.games[game_id]
+    for group in ("brown", "light_blue"):
+        for position in engine.color_groups[group]:
+            state["properties"][str(position)] = {
+                "owner_id": player_id, "houses": 0, "hotels": 0, "mortgaged": False}
+    return game_id, player_id, state
+
+
+def _levels(engine, state, group):
+    return [engine._building_level(state["properties"][str(p)]) for p in engine.color_groups[group]]
+
+
+def test_partial_group_is_rejected(engine, game, run):
+    game_id, (player_id, _) = game
+    engine.games[game_id]["properties"]["1"] = {
+        "owner_id": player_id, "houses": 0, "hotels": 0, "mortgaged": False}
+    result = run(engine.change_buildings(game_id, player_id, {1: 1}))
+    assert result == {"success": False, "error": "Для строительства нужна вся цветовая группа"}
+
+
+def test_mortgaged_group_is_rejected(engine, owner, run):
+    game_id, player_id, state = owner
+    state["properties"]["3"]["mortgaged"] = True
+    result = run(engine.change_buildings(game_id, player_id, {1: 1}))
+    assert result["error"] == "В группе есть заложенная недвижимость"
+
+
+def test_uneven_build_is_rejected(engine, owner, run):
+    game_id, player_id, _ = owner
+    result = run(engine.change_buildings(game_id, player_id, {1: 2, 3: 0}))
+    assert result["error"] == "Нарушено правило равномерной застройки"
+
+
+def test_bank_shortage_is_rejected(engine, owner, run):
+    game_id, player_id, state = owner
+    state["houses_remaining"] = 1
+    result = run(engine.change_buildings(game_id, player_id, {1: 1, 3: 1}))
+    assert result["error"] == "В банке не хватает домов"
+
+
+def test_selling_hotels_back_to_houses_needs_houses_from_bank(engine, owner, run):
+    game_id, player_id, state = owner
+    player = engine._get_player(state, player_id)
+    player["money"] = 10000
+    assert run(engine.change_buildings(game_id, player_id, {1: 5, 3: 5}))["success"]
+    assert (state["houses_remaining"], state["hotels_remaining"]) == (32, 10)
+
+    state["houses_remaining"] = 7
+    assert run(engine.change_buildings(game_id, player_id, {1: 4, 3: 4}))["error"] == "В банке не хватает домов"
+
+    state["houses_remaining"] = 8
+    money = player["money"]
+    result = run(engine.change_buildings(game_id, player_id, {1: 4, 3: 4}))
+    assert result["success"] and result["refund"] == 2 * (50 // 2)
+    assert (state["houses_remaining"], state["hotels_remaining"]) == (0, 12)
+    assert _levels(engine, state, "brown") == [4, 4]
+    assert player["money"] == money + result["refund"]
+
+
+def test_batch_is_atomic_and_bumps_version_once(engine, owner, run):
+    game_id, player_id, state = owner
+    player = engine._get_player(state, player_id)
+    money, version = player["money"], state["version"]
+
+    # Коричневая группа корректна, голубая нарушает равномерность — не меняется ничего
+    result = run(engine.change_buildings(game_id, player_id, {1: 1, 3: 1, 6: 2}))
+    assert not result["success"]
+    assert _levels(engine, state, "brown") == [0, 0]
+    assert (player["money"], state["version"], state["houses_remaining"]) == (money, version, 32)
+
+    result = run(engine.change_buildings(game_id, player_id, {1: 1, 3: 1, 6: 1, 8: 1, 9: 1}))
+    assert result["success"]
+    assert state["version"] == version + 1
+    assert player["money"] == money - result["cost"]
+    assert state["houses_remaining"] == 27
+
+
+def test_unchanged_batch_is_rejected(engine, owner, run):
+    game_id, player_id, state = owner
+    version = state["version"]
+    assert not run(engine.change_buildings(game_id, player_id, {1: 0}))["success"]
+    assert state["version"] == version
+
+
+@pytest.mark.parametrize("budget, houses_remaining, hotels_remaining", [
+    (700, 32, 12),
+    (1500, 6, 12),
+    (1500, 32, 1),
+    (1500, 3, 2),
+])
+def test_plan_matches_brute_force_and_applies(engine, owner, run, budget, houses_remaining, hotels_remaining):
+    game_id, player_id, state = owner
+    state["houses_remaining"], state["hotels_remaining"] = houses_remaining, hotels_remaining
+    plan = run(engine.plan_build(game_id, player_id, budget))
+
+    positions = engine.color_groups["brown"] + engine.color_groups["light_blue"]
+    best = 0
+    for levels in itertools.product(range(6), repeat=len(positions)):
+        chosen = dict(zip(positions, levels))
+        if any(max(chosen[p] for p in engine.color_groups[g]) - min(chosen[p] for p in engine.color_groups[g]) > 1
+               for g in ("brown", "light_blue")):
+            continue
+        if sum(chosen[p] * engine.board_squares[p]["house_price"] for p in positions) > budget:
+            continue
+        if (sum(level for level in levels if level < 5) > houses_remaining
+                or levels.count(5) > hotels_remaining):
+            continue
+        best = max(best, sum(engine._level_rent(p, chosen[p]) - engine._level_rent(p, 0) for p in positions))
+    assert plan["rent_gain"] == best
+
+    result = run(engine.change_buildings(game_id, player_id, plan["levels"]))
+    assert result["success"] and result["cost"] == plan["cost"]
+
+
+def test_plan_with_negative_budget_is_empty(engine, owner, run):
+    game_id, player_id, _ = owner
+    plan = run(engine.plan_build(game_id, player_id, -1))
+    assert plan == {"success": True, "levels": {}, "cost": 0, "rent_gain": 0, "budget": 0}
+
+
+def test_plan_requires_active_game(engine, run):
+    created = run(engine.create_game("alice"))
+    player_id = run(engine.join_game("alice", created["game_code"]))["player_id"]
+    assert run(engine.plan_build(created["game_id"], player_id))["error"] == "Игра не идет"
+
+
+def test_built_group_cannot_be_mortgaged(engine, owner, run):
+    game_id, player_id, state = owner
+    assert run(engine.change_buildings(game_id, player_id, {1: 1}))["success"]
+    result = run(engine.mortgage_property(game_id, player_id, 3))
+    assert result["error"] == "Сначала продайте все постройки в цветовой группе"
+
+    assert run(engine.change_buildings(game_id, player_id, {1: 0}))["success"]
+    assert run(engine.mortgage_property(game_id, player_id, 3))["success"]
+
+
+def test_bankruptcy_returns_buildings_to_bank(engine, owner, run):
+    game_id, player_id, state = owner
+    engine._get_player(state, player_id)["money"] = 10000
+    assert run(engine.change_buildings(game_id, player_id, {1: 4, 3: 4, 6: 5, 8: 5, 9: 5}))["success"]
+    assert (state["houses_remaining"], state["hotels_remaining"]) == (24, 9)
+
+    run(engine._handle_bankruptcy(game_id, player_id))
+    assert (state["houses_remaining"], state["hotels_remaining"]) == (32, 12)
+    assert state["properties"] == {}
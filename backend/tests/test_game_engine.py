@@ -0,0 +1,50 @@
+import inspect
+
+from game_engine import ENGINE_METHODS, MonopolyEngine
+
+
+def test_engine_methods_are_public_coroutines():
+    for name in ENGINE_METHODS:
+        assert not name.startswith("_")
+        assert inspect.iscoroutinefunction(getattr(MonopolyEngine, name))
+
+
+def test_actions_rejected_before_start(engine, run):
+    created = run(engine.create_game("alice"))
+    player_id = run(engine.join_game("alice", created["game_code"]))["player_id"]
+    run(engine.join_game("bob", created["game_code"]))
+    game_id = created["game_id"]
+
+    assert run(engine.roll_dice(game_id, player_id)) == {"success": False, "error": "Игра не идет"}
+    assert not run(engine.buy_property(game_id, player_id, 0))["success"]
+    assert not run(engine.end_turn(game_id, player_id))["success"]
+    assert engine.games[game_id]["properties"] == {}
+
+
+def test_buy_requires_turn_and_standing_on_square(engine, game, run):
+    game_id, (current, other) = game
+    player = engine._get_player(engine.games[game_id], current)
+    player["position"] = 1
+
+    assert run(engine.buy_property(game_id, other, 1))["error"] == "Не ваш ход"
+    assert not run(engine.buy_property(game_id, current, 39))["success"]
+    assert run(engine.buy_property(game_id, current, 1))["success"]
+
+
+def test_buy_rejects_unbuyable_and_out_of_range_squares(engine, game, run):
+    game_id, (current, _) = game
+    assert run(engine.buy_property(game_id, current, 0))["error"] == "Эту клетку нельзя купить"
+    assert run(engine.buy_property(game_id, current, 99))["error"] == "Нет такой клетки"
+    assert run(engine.mortgage_property(game_id, current, 99))["error"] == "Нет такой клетки"
+
+
+def test_unknown_game_is_an_error_not_an_exception(engine, run):
+    for call in (engine.roll_dice("missing", "p"), engine.buy_property("missing", "p", 1),
+                 engine.end_turn("missing", "p"), engine.mortgage_property("missing", "p", 1)):
+        assert run(call) == {"success": False, "error": "Игра не найдена"}
+
+
+def test_end_turn_passes_turn(engine, game, run):
+    game_id, (current, other) = game
+    assert run(engine.end_turn(game_id, current))["next_player_id"] == other
+    assert run(engine.roll_dice(game_id, current))["error"] == "Не ваш ход"
@@ -0,0 +1,62 @@
+from leaderboard import EventJournal, LeaderboardReadModel, events_from_game_actions, game_action_from_event
+
+
+def _play(run, engine, game_id, turns):
+    game = engine.games[game_id]
+    for _ in range(turns):
+        if game["status"] != "active":
+            break
+        player_id = game["turn_order"][game["current_player_index"]]
+        rolled = run(engine.roll_dice(game_id, player_id))
+        if (rolled.get("action_result") or {}).get("action") == "can_buy":
+            run(engine.buy_property(game_id, player_id, rolled["new_position"]))
+        run(engine.end_turn(game_id, player_id))
+
+
+def test_rebuild_from_game_actions_matches_incremental_model(engine, run):
+    live = LeaderboardReadModel(board=engine.board_squares)
+    journal = []
+    engine.event_listeners.append(live.apply)
+    engine.event_listeners.append(lambda game_id, event: journal.append(game_action_from_event(game_id, event)))
+
+    created = run(engine.create_game("alice"))
+    for username in ("alice", "bob", "carol"):
+        run(engine.join_game(username, created["game_code"]))
+    run(engine.start_game(created["game_id"]))
+    _play(run, engine, created["game_id"], 150)
+
+    rebuilt = LeaderboardReadModel(board=engine.board_squares)
+    rebuilt.rebuild(events_from_game_actions(journal))
+    assert live.events_applied > 0
+    for username in ("alice", "bob", "carol"):
+        assert rebuilt.user(username) == live.user(username)
+    assert rebuilt.top("rent_collected") == live.top("rent_collected")
+    assert rebuilt.user("alice")["games_played"] == 1
+
+
+def test_journal_survives_restart(engine, run, tmp_path):
+    path = str(tmp_path / "stats" / "events.jsonl")
+    journal = EventJournal(path)
+    live = LeaderboardReadModel(board=engine.board_squares)
+    engine.event_listeners.extend([journal.append, live.apply])
+
+    created = run(engine.create_game("alice"))
+    for username in ("alice", "bob"):
+        run(engine.join_game(username, created["game_code"]))
+    run(engine.start_game(created["game_id"]))
+    _play(run, engine, created["game_id"], 100)
+    journal.close()
+    # Оборванная при сбое последняя строка не мешает пересборке
+    with open(path, "a", encoding="utf-8") as file:
+        file.write('{"game_id": "x", "ev')
+
+    # После перезапуска запись продолжается с новой строки
+    reopened = EventJournal(path)
+    reopened.append(created["game_id"], {"type": "game_finished", "winner": "bob"})
+    reopened.close()
+    live.apply(created["game_id"], {"type": "game_finished", "winner": "bob"})
+
+    restarted = LeaderboardReadModel(board=engine.board_squares)
+    assert restarted.rebuild(EventJournal(path).events()) == live.events_applied
+    for username in ("alice", "bob"):
+        assert restarted.user(username) == live.user(username)
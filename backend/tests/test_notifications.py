@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import httpx
+
+from notifications import BotApiClient, BotApiStub, NotificationPipeline, NotificationStats
+
+CHAT_ID = 42
+
+
+class FailingBotApiStub(BotApiStub):
+    """Заглушка, отвечающая ошибкой на первые failures вызовов"""
+
+    def __init__(self, failures: int, status: int, retry_after: float = None):
+        super().__init__(per_chat_interval=0.0)
+        self.failures = failures
+        self.status = status
+        self.retry_after = retry_after
+        self.failed_at = []
+        self.succeeded_at = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if len(self.failed_at) < self.failures:
+            self.calls += 1
+            self.failed_at.append(time.monotonic())
+            body = {"ok": False, "description": "failure"}
+            if self.retry_after is not None:
+                body["parameters"] = {"retry_after": self.retry_after}
+            return httpx.Response(self.status, json=body)
+        self.succeeded_at.append(time.monotonic())
+        return super().handle(request)
+
+
+def _pipeline(stub, **options):
+    api = BotApiClient("test-token", base_url="http://bot-api.local",
+                       client=httpx.AsyncClient(transport=stub.transport()))
+    settings = {"coalesce_window": 0.05, "edit_window": 10.0, "per_chat_rate": 100.0,
+                "per_chat_burst": 10.0, "backoff_base": 0.01}
+    settings.update(options)
+    pipeline = NotificationPipeline(api, **settings)
+    pipeline.subscribe("game", CHAT_ID)
+    return pipeline
+
+
+def _publish(pipeline, *messages):
+    for message in messages:
+        pipeline.publish("game", {"message": message})
+
+
+def test_lines_within_window_are_coalesced_into_one_message(run):
+    stub = BotApiStub(per_chat_interval=0.0)
+
+    async def scenario():
+        pipeline = _pipeline(stub)
+        pipeline.start()
+        _publish(pipeline, "first", "second", "third")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert list(stub.messages[CHAT_ID].values()) == ["first\nsecond\nthird"]
+    assert pipeline.stats.messages_sent == 1
+    assert pipeline.stats.lines_delivered == 3
+
+
+def test_followup_lines_edit_the_recent_message(run):
+    stub = BotApiStub(per_chat_interval=0.0)
+
+    async def scenario():
+        pipeline = _pipeline(stub)
+        pipeline.start()
+        _publish(pipeline, "first")
+        await asyncio.sleep(0.15)
+        _publish(pipeline, "second")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert list(stub.messages[CHAT_ID].values()) == ["first\nsecond"]
+    assert (pipeline.stats.messages_sent, pipeline.stats.edits) == (1, 1)
+
+
+def test_rate_limited_send_waits_retry_after(run):
+    stub = FailingBotApiStub(failures=1, status=429, retry_after=0.2)
+
+    async def scenario():
+        pipeline = _pipeline(stub)
+        pipeline.start()
+        _publish(pipeline, "line")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert stub.succeeded_at[0] - stub.failed_at[0] >= 0.2
+    assert pipeline.stats.rate_limited == 1
+    assert pipeline.stats.lines_delivered == 1
+
+
+def test_server_errors_are_retried(run):
+    stub = FailingBotApiStub(failures=2, status=502)
+
+    async def scenario():
+        pipeline = _pipeline(stub)
+        pipeline.start()
+        _publish(pipeline, "line")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert pipeline.stats.retries == 2
+    assert list(stub.messages[CHAT_ID].values()) == ["line"]
+
+
+def test_lines_fail_after_max_retries(run):
+    stub = FailingBotApiStub(failures=100, status=500)
+
+    async def scenario():
+        pipeline = _pipeline(stub, max_retries=2)
+        pipeline.start()
+        _publish(pipeline, "a", "b")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert pipeline.stats.lines_failed == 2
+    assert len(stub.failed_at) == 3
+
+
+def test_finished_game_unsubscribes_and_releases_chat_state(run):
+    stub = BotApiStub(per_chat_interval=0.0)
+
+    async def scenario():
+        pipeline = _pipeline(stub)
+        pipeline.start()
+        _publish(pipeline, "winner")
+        pipeline.handle_event("game", {"type": "game_finished", "winner": "alice"})
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert list(stub.messages[CHAT_ID].values()) == ["winner"]
+    assert pipeline.subscribers == {}
+    assert pipeline.chats == {}
+
+
+def test_latency_samples_are_bounded():
+    stats = NotificationStats(latency_window=3)
+    stats.latencies.extend([0.1, 0.2, 0.3, 0.4])
+    assert list(stats.latencies) == [0.2, 0.3, 0.4]
@@ -0,0 +1,76 @@
+import asyncio
+
+import profiling
+from game_engine import ENGINE_METHODS, MonopolyEngine
+from profiling import EngineProfiler
+
+
+def test_disable_restores_class_methods(engine, run):
+    async def scenario():
+        profiler = EngineProfiler(engine)
+        profiler.enable()
+        assert all(name in vars(engine) for name in ENGINE_METHODS)
+        profiler.disable()
+
+    run(scenario())
+    # Выключенный профилировщик не оставляет оберток: вызовы идут прямо в методы класса
+    for name in ENGINE_METHODS:
+        assert name not in vars(engine)
+        assert getattr(engine, name).__func__ is getattr(MonopolyEngine, name)
+
+
+def test_enable_summary_disable(engine, run):
+    async def scenario():
+        profiler = EngineProfiler(engine)
+        profiler.enable()
+        created = await engine.create_game("alice")
+        await engine.join_game("bob", created["game_code"])
+        await engine.get_game_state(created["game_id"])
+        summary = profiler.summary()
+        profiler.disable()
+        return created["game_id"], summary, profiler
+
+    game_id, summary, profiler = run(scenario())
+    assert summary["enabled"] and summary["recent_calls"] == 3
+    assert set(summary["actions"]) == {"create_game", "join_game", "get_game_state"}
+    assert [game["game_id"] for game in summary["games"]] == [game_id]
+    assert summary["games"][0]["calls"] == 3
+    assert not profiler.enabled and profiler.loop_lag._task is None
+
+
+def test_by_game_is_bounded(engine, run):
+    async def scenario():
+        profiler = EngineProfiler(engine, max_games=2)
+        profiler.enable()
+        for game_id in ("a", "b", "a", "c"):
+            await engine.get_game_state(game_id)
+        profiler.disable()
+        return profiler
+
+    profiler = run(scenario())
+    # «b» вызывался давнее всех и вытеснен, «a» освежен повторным вызовом
+    assert list(profiler.by_game) == ["a", "c"]
+    assert profiler.games_evicted == 1
+
+
+def test_current_call_is_per_task(run):
+    seen = {}
+
+    class InterleavingEngine(MonopolyEngine):
+        """Как ShardedEngine: вызов уступает цикл посреди выполнения"""
+
+        async def get_game_state(self, game_id):
+            await asyncio.sleep(0)
+            seen[game_id] = profiling._current_call.get()
+            return None
+
+    async def scenario():
+        engine = InterleavingEngine()
+        profiler = EngineProfiler(engine)
+        profiler.enable()
+        await asyncio.gather(*(engine.get_game_state(game_id) for game_id in ("g1", "g2", "g3")))
+        profiler.disable()
+        assert profiling._current_call.get() is None
+
+    run(scenario())
+    assert seen == {game_id: ("get_game_state", game_id) for game_id in ("g1", "g2", "g3")}
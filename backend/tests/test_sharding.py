@@ -0,0 +1,126 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+import sharding
+from sharding import ShardError, ShardedEngine, spawn_shards
+
+
+async def _create_games(engine, count):
+    game_ids = []
+    for n in range(count):
+        created = await engine.create_game(f"user_{n}")
+        await engine.join_game("alice", created["game_code"])
+        game_ids.append(created["game_id"])
+    return game_ids
+
+
+async def _games_per_shard(engine):
+    return {info["address"]: info["games"] for info in await engine.shard_info()}
+
+
+def test_add_and_remove_shard_keep_every_game_routable(run):
+    async def scenario():
+        processes, paths = spawn_shards(3)
+        engine = ShardedEngine(paths[:2], processes)
+        try:
+            game_ids = await _create_games(engine, 60)
+            assert await engine.add_shard(paths[2]) > 0
+            assert all([await engine.has_game(game_id) for game_id in game_ids])
+            await engine.remove_shard(paths[0])
+            assert all([await engine.has_game(game_id) for game_id in game_ids])
+            assert sum((await _games_per_shard(engine)).values()) == len(game_ids)
+        finally:
+            await engine.close()
+
+    run(scenario())
+
+
+def test_failed_rebalance_rolls_back_without_losing_games(run):
+    async def scenario():
+        processes, paths = spawn_shards(3)
+        engine = ShardedEngine(paths, processes)
+        try:
+            game_ids = await _create_games(engine, 60)
+            before = await _games_per_shard(engine)
+
+            failing = engine.connections[paths[2]]
+            original_call = failing.call
+
+            async def call(method, *args, **kwargs):
+                if method == "import_games":
+                    raise ShardError("import failed")
+                return await original_call(method, *args, **kwargs)
+
+            failing.call = call
+            with pytest.raises(ShardError):
+                await engine.remove_shard(paths[0])
+            failing.call = original_call
+
+            assert engine.ring.shards == paths
+            assert all([await engine.has_game(game_id) for game_id in game_ids])
+            assert await _games_per_shard(engine) == before
+        finally:
+            await engine.close()
+
+    run(scenario())
+
+
+def test_shared_topology_rejects_rebalance(run):
+    engine = ShardedEngine(["/tmp/shard-a.sock"], owns_topology=False)
+    with pytest.raises(ShardError):
+        run(engine.add_shard("/tmp/shard-b.sock"))
+
+
+def test_dead_shard_gives_shard_error_and_reconnects_after_restart(run):
+    async def scenario():
+        processes, paths = spawn_shards(1)
+        engine = ShardedEngine(paths, processes)
+        try:
+            created = await engine.create_game("alice")
+            connection = engine.connections[paths[0]]
+            processes[0].kill()
+            processes[0].wait()
+            for _ in range(3):
+                with pytest.raises(ShardError):
+                    await engine.get_game_state(created["game_id"])
+            assert connection.closed and connection._pending == {}
+
+            processes[0] = subprocess.Popen([sys.executable, sharding.__file__, "shard", "--socket", paths[0]])
+            # Состояние упавшего шарда потеряно, но маршрутизация снова работает
+            for _ in range(100):
+                try:
+                    assert await engine.get_game_state(created["game_id"]) is None
+                    break
+                except ShardError:
+                    await asyncio.sleep(0.05)
+            else:
+                pytest.fail("Роутер не переподключился к перезапущенному шарду")
+        finally:
+            await engine.close()
+
+    run(scenario())
+
+
+def test_hung_shard_call_times_out(run):
+    async def scenario():
+        path = os.path.join(tempfile.mkdtemp(), "hung.sock")
+
+        async def never_answer(reader, writer):
+            await reader.read()
+
+        server = await asyncio.start_unix_server(never_answer, path=path)
+        engine = ShardedEngine([path], call_timeout=0.1)
+        try:
+            with pytest.raises(ShardError, match="не ответил"):
+                await engine.has_game("game")
+            assert engine.connections[path]._pending == {}
+        finally:
+            await engine.close()
+            server.close()
+
+    run(scenario())
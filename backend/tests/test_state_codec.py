@@ -0,0 +1,45 @@
+import pytest
+
+from state_codec import GameSnapshot, decode_game, encode_game
+
+
+def test_round_trip(engine, game, run):
+    game_id, (current, _) = game
+    run(engine.roll_dice(game_id, current))
+    state = engine.games[game_id]
+    data = encode_game(state)
+    assert decode_game(data) == state
+    assert GameSnapshot(data).meta["id"] == game_id
+
+
+@pytest.mark.parametrize("key, value", [
+    ("max_players", 300),
+    ("current_player_index", -1),
+    ("houses_remaining", 70000),
+])
+def test_out_of_range_meta_raises_value_error(engine, game, key, value):
+    game_id, _ = game
+    state = dict(engine.games[game_id], **{key: value})
+    with pytest.raises(ValueError, match=key):
+        encode_game(state)
+
+
+def test_out_of_range_player_field_raises_value_error(engine, game):
+    game_id, _ = game
+    state = engine.games[game_id]
+    state["players"][0]["money"] = 2 ** 40
+    with pytest.raises(ValueError):
+        encode_game(state)
+
+
+def test_engine_rejects_unsupported_player_count(engine, run):
+    assert not run(engine.create_game("alice", max_players=300))["success"]
+    assert not run(engine.create_game("alice", max_players=1))["success"]
+
+
+@pytest.mark.parametrize("username", ["evil\0name", "x" * 70000, "broken\ud800surrogate"])
+def test_any_username_round_trips(engine, run, username):
+    created = run(engine.create_game(username))
+    run(engine.join_game(username, created["game_code"]))
+    state = engine.games[created["game_id"]]
+    assert decode_game(encode_game(state)) == state